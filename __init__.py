@@ -3,6 +3,7 @@ from .nodes.writer import *
 from .nodes.generator import *
 from .nodes.prompt import *
 from .server.routes import *
+from .nodes.utils import start_catalog_scan, start_prehash
 
 NODE_CLASS_MAPPINGS = {
     "SQ Image Writer": SQImageWriter,
@@ -19,5 +20,8 @@ NODE_CLASS_MAPPINGS = {
 
 WEB_DIRECTORY = "./js"
 
+start_prehash()
+start_catalog_scan()
+
 
 __all__ = ["NODE_CLASS_MAPPINGS", "WEB_DIRECTORY"]
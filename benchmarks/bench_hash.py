@@ -0,0 +1,95 @@
+"""Compare the original chunked sha256 loop with the reused-buffer engine.
+
+    python benchmarks/bench_hash.py --size-mb 2048 --files 4
+
+Files are written to a temporary directory (or --dir) with random content.
+Note that after the first pass the files are in the page cache, so the
+numbers measure CPU/allocation cost rather than disk speed.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes.hashing import HashStore, hash_files, sha256_file  # noqa: E402
+
+
+def legacy_sha256_file(filename: str):
+    sha256 = hashlib.sha256()
+    blksize = 1024 * 1024
+
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(blksize), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def make_file(path: str, size: int):
+    block = os.urandom(16 * 1024 * 1024)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[: min(remaining, len(block))])
+            remaining -= len(block)
+
+
+def measure(name: str, fn, total_bytes: int, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<32} {best:8.3f}s {total_bytes / best / 1e6:10.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dir", default=None)
+    parser.add_argument("--block-kb", type=int, nargs="+", default=[1024, 4096, 16384])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        size = args.size_mb * 1024 * 1024
+        paths = [os.path.join(tmp, f"model_{i}.bin") for i in range(args.files)]
+        for p in paths:
+            make_file(p, size)
+        print(f"{args.files} files x {args.size_mb} MiB in {tmp}")
+
+        measure(
+            "legacy (1 file)", lambda: legacy_sha256_file(paths[0]), size, args.repeat
+        )
+        for kb in args.block_kb:
+            measure(
+                f"readinto {kb} KiB (1 file)",
+                lambda: sha256_file(paths[0], kb * 1024),
+                size,
+                args.repeat,
+            )
+
+        total = size * len(paths)
+        measure(
+            f"legacy ({len(paths)} files, serial)",
+            lambda: [legacy_sha256_file(p) for p in paths],
+            total,
+            args.repeat,
+        )
+
+        def concurrent():
+            # fresh store each run so nothing is served from the cache
+            store = HashStore(os.path.join(tmp, f"{time.time_ns()}.db"))
+            hash_files(paths, store=store)
+
+        measure(f"hash_files ({len(paths)} files)", concurrent, total, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare PNG file size and write time with the workflow stored as plain tEXt
+chunks against compressed iTXt chunks, and check both read back the same.
+
+    python benchmarks/bench_png_metadata.py --size 1024 --nodes 400
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+
+def make_chunks(nodes: int):
+    # node graphs repeat their keys and widget names, so they compress well
+    workflow = {
+        "nodes": [
+            {
+                "id": i,
+                "type": "KSampler",
+                "pos": [i * 10, i * 20],
+                "size": [315, 262],
+                "inputs": [{"name": "model", "type": "MODEL", "link": i}],
+                "outputs": [{"name": "LATENT", "type": "LATENT", "links": [i + 1]}],
+                "widgets_values": [i, "randomize", 25, 6.5, "euler", "normal", 1.0],
+            }
+            for i in range(nodes)
+        ]
+    }
+    prompt = {
+        str(i): {"class_type": "KSampler", "inputs": {"seed": i, "steps": 25}}
+        for i in range(nodes)
+    }
+    return {"workflow": json.dumps(workflow), "prompt": json.dumps(prompt)}
+
+
+def write(img: Image.Image, path: str, chunks: dict, compress: bool):
+    info = PngInfo()
+    for key, value in chunks.items():
+        if compress:
+            info.add_itxt(key, value, zip=True)
+        else:
+            info.add_text(key, value)
+    img.save(path, pnginfo=info, compress_level=4)
+
+
+def measure(name, img, path, chunks, compress, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        write(img, path, chunks, compress)
+        best = min(best, time.perf_counter() - start)
+    print(
+        f"{name:<12} {best * 1e3:8.1f} ms  size {os.path.getsize(path) / 1e3:10.1f} KB"
+    )
+    with Image.open(path) as check:
+        assert all(check.info[key] == value for key, value in chunks.items())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--nodes", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0 : args.size, 0 : args.size]
+    base = np.stack([x, y, x + y], axis=-1) * (255.0 / (2 * args.size))
+    pixels = np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels)
+    chunks = make_chunks(args.nodes)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.png")
+        text_kb = sum(len(value) for value in chunks.values()) / 1e3
+        print(f"{args.size}x{args.size} png, {text_kb:.0f} KB of metadata")
+        measure("tEXt", img, path, chunks, False, args.repeat)
+        measure("iTXt zip", img, path, chunks, True, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Compare the regex substitution wildcard parser with the compiled grammar.
+
+python benchmarks/bench_prompt.py
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nodes.pure_utils import compile_template, parse_text  # noqa: E402
+
+
+def legacy_parse_text(text: str):
+    while True:
+        match = re.search(r"\{([^\{\}]*)\}", text)
+        if match is None:
+            break
+        options = match.group(1).split("|")
+        weights = []
+        for i in range(len(options)):
+            o = options[i].strip()
+            weight_match = re.search(r"\s*^(\d*\.?\d*):", o)
+            if weight_match:
+                weight = float(weight_match.group(1))
+                options[i] = o.replace(weight_match.group(0), "")
+                weights.append(weight)
+            else:
+                weights.append(1)
+        choice = random.choices(options, weights, k=1)[0]
+        text = text.replace(match.group(0), choice, 1)
+    if re.search(r"[{}]", text):
+        raise ValueError("Brackets are not matching")
+    s = text.split(",")
+    s = map(str.strip, s)
+    s = filter(bool, s)
+    text = ", ".join(s)
+    return text
+
+
+def nested(depth: int):
+    text = "leaf"
+    for i in range(depth):
+        text = f"{{2:word{i}, {text}|other{i}, {text}}}"
+    return text
+
+
+def wide(groups: int, options: int):
+    return ", ".join(
+        "{" + "|".join(f"option {g}-{o}" for o in range(options)) + "}"
+        for g in range(groups)
+    )
+
+
+def measure(name, fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    cases = [
+        ("nested depth 8", nested(8)),
+        ("nested depth 12", nested(12)),
+        ("wide 50x10", wide(50, 10)),
+        ("wide 500x20", wide(500, 20)),
+    ]
+    print(
+        f"{'template':<18} {'chars':>9} {'legacy':>10} {'compiled':>10} {'speedup':>8}"
+    )
+    for name, text in cases:
+        legacy = measure(name, legacy_parse_text, text, args.repeat)
+        compile_template.cache_clear()
+        parse_text(text)  # compile once, as repeated node executions would
+        compiled = measure(name, parse_text, text, args.repeat)
+        print(
+            f"{name:<18} {len(text):>9} {legacy * 1e3:>8.2f}ms {compiled * 1e3:>8.2f}ms "
+            f"{legacy / compiled:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Compare writing a lossless WebP and then inserting EXIF with piexif against
+passing the EXIF block to the encoder.
+
+    python benchmarks/bench_webp.py --size 4096 --metadata-kb 200
+
+I/O is taken from /proc/self/io where available (Linux).
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import piexif
+import piexif.helper
+from PIL import Image
+
+
+def io_counters():
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except OSError:
+        return None
+
+
+def make_exif(metadata_kb: int):
+    workflow = json.dumps({"nodes": ["x" * 100] * (metadata_kb * 10)})
+    return piexif.dump(
+        {
+            "Exif": {
+                piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(
+                    "positive prompt\nNegative prompt: bad\nSteps: 20",
+                    encoding="unicode",
+                )
+            },
+            "0th": {
+                piexif.ImageIFD.Software: json.dumps({"seed": 1}),
+                0x010F: f"workflow:{workflow}",
+            },
+        }
+    )
+
+
+def two_pass(img: Image.Image, path: str, exif: bytes):
+    img.save(path, lossless=True)
+    piexif.insert(exif, path)
+
+
+def single_pass(img: Image.Image, path: str, exif: bytes):
+    img.save(path, lossless=True, exif=exif)
+
+
+def measure(name, fn, img, path, exif, repeat):
+    best = float("inf")
+    io = None
+    for _ in range(repeat):
+        if os.path.exists(path):
+            os.remove(path)
+        before = io_counters()
+        start = time.perf_counter()
+        fn(img, path, exif)
+        best = min(best, time.perf_counter() - start)
+        after = io_counters()
+        if before and after:
+            io = (after[0] - before[0], after[1] - before[1])
+    io_str = f"read {io[0] / 1e6:8.2f} MB  written {io[1] / 1e6:8.2f} MB" if io else ""
+    print(
+        f"{name:<12} {best:8.3f}s  size {os.path.getsize(path) / 1e6:8.2f} MB  {io_str}"
+    )
+    with Image.open(path) as check:
+        assert check.getexif()[piexif.ImageIFD.Software] == json.dumps({"seed": 1})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--metadata-kb", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # smooth gradient plus noise so the lossless encoder has realistic work
+    y, x = np.mgrid[0 : args.size, 0 : args.size]
+    base = np.stack([x, y, x + y], axis=-1) * (255.0 / (2 * args.size))
+    pixels = np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels)
+    exif = make_exif(args.metadata_kb)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.webp")
+        print(f"{args.size}x{args.size} lossless webp, {len(exif) / 1e3:.0f} KB exif")
+        measure("two-pass", two_pass, img, path, exif, args.repeat)
+        measure("single-pass", single_pass, img, path, exif, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
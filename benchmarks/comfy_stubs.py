@@ -0,0 +1,113 @@
+"""Minimal stand-ins for the ComfyUI modules the nodes import, so the node
+code can be driven on CPU without ComfyUI or a GPU.
+
+Only what the benchmarked code paths touch is provided. Call install() before
+importing anything from nodes/.
+"""
+
+import os
+import sys
+import types
+import uuid
+
+import torch
+
+SAMPLERS = ["euler", "euler_ancestral", "dpmpp_2m"]
+SCHEDULERS = ["normal", "karras", "simple"]
+
+
+def _module(name: str, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install(base_dir: str):
+    """Register stub modules; output and model folders live under base_dir"""
+    output_dir = os.path.join(base_dir, "output")
+    models_dir = os.path.join(base_dir, "models")
+    os.makedirs(output_dir, exist_ok=True)
+
+    def get_full_path(folder_name, filename):
+        path = os.path.join(models_dir, folder_name, filename)
+        return path if os.path.isfile(path) else None
+
+    def get_full_path_or_raise(folder_name, filename):
+        path = get_full_path(folder_name, filename)
+        if path is None:
+            raise FileNotFoundError(f"{folder_name}/{filename}")
+        return path
+
+    def get_filename_list(folder_name):
+        folder = os.path.join(models_dir, folder_name)
+        return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+    _module(
+        "folder_paths",
+        get_output_directory=lambda: output_dir,
+        get_full_path=get_full_path,
+        get_full_path_or_raise=get_full_path_or_raise,
+        get_filename_list=get_filename_list,
+        get_folder_paths=lambda folder_name: [os.path.join(models_dir, folder_name)],
+        models_dir=models_dir,
+    )
+
+    comfy = _module("comfy")
+    comfy.cli_args = _module(
+        "comfy.cli_args", args=types.SimpleNamespace(disable_metadata=False)
+    )
+    comfy.samplers = _module(
+        "comfy.samplers",
+        KSampler=types.SimpleNamespace(SAMPLERS=SAMPLERS, SCHEDULERS=SCHEDULERS),
+    )
+    comfy.model_management = _module(
+        "comfy.model_management",
+        intermediate_device=lambda: torch.device("cpu"),
+        get_total_memory=lambda device=None: 16 * 1024**3,
+    )
+    comfy.utils = _module(
+        "comfy.utils",
+        load_torch_file=lambda path, safe_load=False, device=None: torch.load(path),
+    )
+    comfy.sd = _module("comfy.sd")
+    comfy.lora = _module("comfy.lora")
+
+    class PromptServer:
+        instance = types.SimpleNamespace(send_sync=lambda *args, **kwargs: None)
+
+    _module("server", PromptServer=PromptServer)
+
+    try:
+        import psutil  # noqa: F401
+    except ImportError:
+        _module(
+            "psutil",
+            virtual_memory=lambda: types.SimpleNamespace(total=16 * 1024**3),
+        )
+    return output_dir, models_dir
+
+
+class FakeTextEncoder:
+    pass
+
+
+class FakeClip:
+    """Encodes text to deterministic random tensors shaped like SDXL output:
+    one 77 token window per 75 whitespace separated words"""
+
+    def __init__(self, width: int = 2048):
+        self.width = width
+        self.cond_stage_model = FakeTextEncoder()
+        self.patcher = types.SimpleNamespace(patches_uuid=uuid.uuid4())
+        self.layer_idx = None
+
+    def tokenize(self, text: str):
+        words = text.split()
+        return [words[i : i + 75] for i in range(0, max(len(words), 1), 75)]
+
+    def encode_from_tokens(self, tokens, return_pooled=False, return_dict=False):
+        generator = torch.Generator().manual_seed(hash(str(tokens)) & 0xFFFFFFFF)
+        cond = torch.randn((1, 77 * len(tokens), self.width), generator=generator)
+        pooled = torch.randn((1, 1280), generator=generator)
+        return {"cond": cond, "pooled_output": pooled}
@@ -0,0 +1,343 @@
+"""Offline benchmark suite for the node pack.
+
+Stubs the ComfyUI modules (see comfy_stubs.py) and times the main code paths
+on CPU over a grid of image sizes, batch sizes, directory sizes and prompt
+complexity. Results are written as JSON so runs can be diffed in review.
+
+    python benchmarks/run.py --output bench.json
+    python benchmarks/run.py --quick --only parse_text save_images
+"""
+
+import argparse
+import atexit
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import comfy_stubs  # noqa: E402
+
+base_dir = tempfile.mkdtemp(prefix="sq-bench-")
+# model files and output directories can run to gigabytes
+atexit.register(shutil.rmtree, base_dir, ignore_errors=True)
+output_dir, models_dir = comfy_stubs.install(base_dir)
+
+from nodes import extract, hashing, prompt, reader, utils  # noqa: E402
+from nodes.pure_utils import compile_template, parse_text  # noqa: E402
+
+results: typing.List[dict] = []
+
+
+def measure(
+    name: str,
+    params: dict,
+    fn: typing.Callable[[], typing.Any],
+    repeat: int,
+    setup: typing.Optional[typing.Callable[[], typing.Any]] = None,
+):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    result = {
+        "name": name,
+        "params": params,
+        "runs": repeat,
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "max_s": max(times),
+    }
+    results.append(result)
+    params_str = " ".join(f"{k}={v}" for k, v in params.items())
+    print(f"{name:<22} {params_str:<48} {result['median_s'] * 1e3:10.2f} ms")
+    return result
+
+
+def make_metadata(loras: int = 2, seed: int = 0):
+    return {
+        "model": {"name": "model.safetensors", "sha": "0123456789"},
+        "vae": {"name": "built-in", "sha": ""},
+        "loras": [
+            {
+                "name": f"lora_{i}.safetensors",
+                "sha": f"{i:010d}",
+                "model_strength": 0.8,
+                "clip_strength": 0.8,
+            }
+            for i in range(loras)
+        ],
+        "seed": seed,
+        "steps": 25,
+        "cfg": 6.5,
+        "sampler": "euler",
+        "scheduler": "normal",
+        "width": 1024,
+        "height": 1024,
+        "positive": ["masterpiece, best quality", "a cat sitting on a window sill"],
+        "negative": ["lowres, bad anatomy"],
+    }
+
+
+def make_images(batch: int, size: int):
+    # smooth content compresses like real renders rather than like noise
+    y = torch.linspace(0, 1, size).view(1, size, 1, 1)
+    x = torch.linspace(0, 1, size).view(1, 1, size, 1)
+    base = torch.cat([x.expand(1, size, size, 1), y.expand(1, size, size, 1)], -1)
+    base = torch.cat([base, (x * y).expand(1, size, size, 1)], -1)
+    noise = torch.rand((batch, size, size, 3)) * 0.05
+    return (base + noise).clamp(0, 1)
+
+
+def bench_save_images(args):
+    workflow = {"nodes": [{"id": i, "widgets_values": ["x" * 200]} for i in range(200)]}
+    for ext in ["png", "webp"]:
+        for size in args.image_sizes:
+            for batch in args.batch_sizes:
+                for dir_size in args.dir_sizes:
+                    directory = f"save_{ext}_{size}_{batch}_{dir_size}"
+                    path = os.path.join(output_dir, directory)
+                    os.makedirs(path)
+                    for i in range(dir_size):
+                        open(os.path.join(path, f"image_{i:06d}.{ext}"), "w").close()
+                    images = make_images(batch, size)
+                    metadata = [make_metadata(seed=i) for i in range(batch)]
+
+                    def save():
+                        utils.save_images(
+                            images,
+                            directory,
+                            f"image_${{6}}.{ext}",
+                            {"1": {"inputs": {}}},
+                            {"workflow": workflow},
+                            metadata,
+                        )
+
+                    params = {"ext": ext, "size": size, "batch": batch, "dir": dir_size}
+                    # the first save seeds the index allocator with a directory scan
+                    measure("save_images.first", params, save, 1)
+                    measure("save_images", params, save, args.repeat)
+
+
+def bench_calculate_hash(args):
+    folder = os.path.join(models_dir, "loras")
+    os.makedirs(folder, exist_ok=True)
+    block = os.urandom(16 * 1024 * 1024)
+    for size_mb in args.hash_sizes_mb:
+        name = f"hash_{size_mb}.safetensors"
+        with open(os.path.join(folder, name), "wb") as f:
+            for _ in range(0, size_mb, 16):
+                f.write(block)
+        params = {"size_mb": size_mb}
+
+        def cold():
+            hashing.hash_store = hashing.HashStore(
+                os.path.join(base_dir, f"hash_{time.time_ns()}.db")
+            )
+
+        measure(
+            "calculate_hash.cold",
+            params,
+            lambda: utils.calculate_hash({}, name, "lora"),
+            args.repeat,
+            setup=cold,
+        )
+        measure(
+            "calculate_hash.persisted",
+            params,
+            lambda: utils.calculate_hash({}, name, "lora"),
+            args.repeat,
+        )
+
+
+def nested_template(depth: int):
+    text = "leaf"
+    for i in range(depth):
+        text = f"{{2:word{i}, {text}|other{i}, {text}}}"
+    return text
+
+
+def wide_template(groups: int, options: int):
+    return ", ".join(
+        "{" + "|".join(f"option {g}-{o}" for o in range(options)) + "}"
+        for g in range(groups)
+    )
+
+
+def bench_parse_text(args):
+    templates = {"plain": "masterpiece, best quality, a cat, window sill"}
+    for depth in args.nesting:
+        templates[f"nested_{depth}"] = nested_template(depth)
+    for groups in args.widths:
+        templates[f"wide_{groups}"] = wide_template(groups, 10)
+    for label, text in templates.items():
+        params = {"template": label, "chars": len(text)}
+        measure(
+            "parse_text.compile",
+            params,
+            lambda: parse_text(text),
+            args.repeat,
+            setup=compile_template.cache_clear,
+        )
+        measure("parse_text", params, lambda: parse_text(text), args.repeat)
+
+
+def bench_format_civit_metadata(args):
+    for loras in [0, 10, 50]:
+        metadata = make_metadata(loras=loras)
+        measure(
+            "format_civit_metadata",
+            {"loras": loras},
+            lambda: [utils.format_civit_metadata(metadata) for _ in range(100)],
+            args.repeat,
+        )
+
+
+def bench_reader(args):
+    node = reader.SQImageReader()
+    for ext in ["png", "webp"]:
+        for size in args.image_sizes:
+            directory = f"read_{ext}_{size}"
+            filename = utils.save_images(
+                make_images(1, size),
+                directory,
+                f"image.{ext}",
+                None,
+                None,
+                [make_metadata()],
+            )[0]
+            path = os.path.join(output_dir, directory, filename)
+            for load_image in ["true", "false"]:
+                params = {"ext": ext, "size": size, "load_image": load_image}
+                measure(
+                    "reader.read",
+                    params,
+                    lambda: node.read(path, load_image),
+                    args.repeat,
+                    setup=reader.read_cache.clear,
+                )
+                measure(
+                    "reader.read.cached",
+                    params,
+                    lambda: node.read(path, load_image),
+                    args.repeat,
+                )
+
+
+def bench_prompt_concat(args):
+    node = prompt.SQAutoPrompt()
+    clip = comfy_stubs.FakeClip()
+    for chunks in args.prompt_chunks:
+        prompts = [f"chunk {i}, " + "word " * 60 for i in range(chunks)]
+        params = {"chunks": chunks}
+
+        def fold():
+            cond = prompt.encode_cond(clip, prompts[0])
+            for p in prompts[1:]:
+                cond = prompt.concat_cond(cond, prompt.encode_cond(clip, p))
+            return cond
+
+        measure("prompt.concat_fold", params, fold, args.repeat)
+        measure(
+            "prompt.auto.uncached",
+            params,
+            lambda: node.parse(prompts, clip),
+            args.repeat,
+            setup=prompt.cond_cache.clear,
+        )
+        measure("prompt.auto", params, lambda: node.parse(prompts, clip), args.repeat)
+
+
+def bench_extract(args):
+    directory = "extract"
+    workflow = {"nodes": [{"id": i, "widgets_values": ["x" * 200]} for i in range(200)]}
+    for ext in ["png", "webp"]:
+        utils.save_images(
+            make_images(args.extract_files // 2, 256),
+            directory,
+            f"image_${{6}}.{ext}",
+            {"1": {"inputs": {}}},
+            {"workflow": workflow},
+            [make_metadata(seed=i) for i in range(args.extract_files // 2)],
+        )
+    paths = list(extract.iter_image_files(os.path.join(output_dir, directory)))
+    for workers in sorted({1, os.cpu_count() or 1}):
+        result = measure(
+            "extract",
+            {"files": len(paths), "workers": workers},
+            lambda: list(extract.iter_extract(paths, workers)),
+            args.repeat,
+        )
+        print(f"{'':<22} {len(paths) / result['median_s']:.0f} files/s")
+
+
+benchmarks = {
+    "save_images": bench_save_images,
+    "calculate_hash": bench_calculate_hash,
+    "parse_text": bench_parse_text,
+    "format_civit_metadata": bench_format_civit_metadata,
+    "reader": bench_reader,
+    "prompt_concat": bench_prompt_concat,
+    "extract": bench_extract,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default=None, help="write JSON results here")
+    parser.add_argument("--only", nargs="+", choices=list(benchmarks), default=None)
+    parser.add_argument("--quick", action="store_true", help="small grid for CI")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat = min(args.repeat, 3)
+        args.image_sizes = [512]
+        args.batch_sizes = [1, 4]
+        args.dir_sizes = [0, 2000]
+        args.hash_sizes_mb = [64]
+        args.nesting = [6]
+        args.widths = [50]
+        args.prompt_chunks = [1, 8]
+        args.extract_files = 200
+    else:
+        args.image_sizes = [512, 1024, 2048]
+        args.batch_sizes = [1, 4, 8]
+        args.dir_sizes = [0, 20000]
+        args.hash_sizes_mb = [256, 1024]
+        args.nesting = [6, 10]
+        args.widths = [50, 500]
+        args.prompt_chunks = [1, 8, 32]
+        args.extract_files = 2000
+
+    for name in args.only or list(benchmarks):
+        benchmarks[name](args)
+
+    report = {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import threading
+import typing
+from collections import OrderedDict
+import psutil
+from .pure_utils import env_int
+
+K = typing.TypeVar("K")
+V = typing.TypeVar("V")
+
+
+class LRUCache(typing.Generic[K, V]):
+    """Thread safe LRU cache bounded by total size and/or entry count.
+
+    Each entry carries a cost in bytes as reported by `sizeof`. Entries
+    larger than the whole budget are not stored, and a budget of 0 stores
+    nothing."""
+
+    def __init__(
+        self,
+        max_bytes: typing.Optional[int] = None,
+        max_items: typing.Optional[int] = None,
+        sizeof: typing.Callable[[V], int] = lambda v: 0,
+    ):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: "OrderedDict[K, typing.Tuple[V, int]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: K):
+        return key in self._entries
+
+    def get(self, key: K, default: typing.Optional[V] = None) -> typing.Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: K, value: V):
+        size = self.sizeof(value)
+        with self._lock:
+            self.pop(key)
+            if self.max_bytes is not None and (
+                size > self.max_bytes or self.max_bytes == 0
+            ):
+                return
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            self._evict()
+
+    def pop(self, key: K):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.total_bytes -= entry[1]
+            return entry[0]
+
+    def get_or_create(self, key: K, create: typing.Callable[[], V]) -> V:
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+            or (self.max_items is not None and len(self._entries) > self.max_items)
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "items": len(self._entries),
+                "bytes": self.total_bytes,
+            }
+
+
+def default_cache_budget(env_name: str, fraction: float):
+    """Budget in bytes from an env var in MB, else a fraction of system RAM"""
+    mb = env_int(env_name, -1)
+    if mb >= 0:
+        return mb * 1024 * 1024
+    return int(psutil.virtual_memory().total * fraction)
+
+
+def state_dict_size(sd: typing.Dict[str, typing.Any]):
+    return sum(getattr(t, "nbytes", 0) for t in sd.values())
@@ -0,0 +1,293 @@
+import json
+import os
+import sqlite3
+import threading
+import typing
+from .db import SharedConnection
+from .extract import image_extensions, iter_image_files
+from .image_io import read_metadata
+from .pure_utils import log, warn
+from .types import MetadataOutput
+
+# rows per transaction when scanning
+scan_batch_size = 1000
+# the reader also handles jpeg files with metadata in their exif
+catalog_extensions = image_extensions + (".jpg", ".jpeg")
+
+schema = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    has_metadata INTEGER NOT NULL,
+    model_name TEXT,
+    model_sha TEXT,
+    vae_name TEXT,
+    vae_sha TEXT,
+    seed INTEGER,
+    steps INTEGER,
+    cfg REAL,
+    sampler TEXT,
+    scheduler TEXT,
+    width INTEGER,
+    height INTEGER,
+    positive TEXT,
+    negative TEXT,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS loras (
+    path TEXT NOT NULL REFERENCES images(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    sha TEXT,
+    model_strength REAL,
+    clip_strength REAL
+);
+CREATE INDEX IF NOT EXISTS images_model_name ON images(model_name);
+CREATE INDEX IF NOT EXISTS images_model_sha ON images(model_sha);
+CREATE INDEX IF NOT EXISTS images_vae_name ON images(vae_name);
+CREATE INDEX IF NOT EXISTS images_seed ON images(seed);
+CREATE INDEX IF NOT EXISTS images_sampler ON images(sampler);
+CREATE INDEX IF NOT EXISTS loras_path ON loras(path);
+CREATE INDEX IF NOT EXISTS loras_name ON loras(name);
+CREATE INDEX IF NOT EXISTS loras_sha ON loras(sha);
+"""
+
+
+class Catalog:
+    """SQLite index of the generation metadata embedded in output images.
+
+    The database lives in the output directory and stores paths relative to
+    it. scan() only reads files whose mtime or size changed since the last
+    scan, and the writer records every image it saves."""
+
+    def __init__(self, root: str, db_name: str = ".sq_catalog.db"):
+        self.root = root
+        self.db_path = os.path.join(root, db_name)
+        self._lock = threading.Lock()
+        self._db = SharedConnection(self.db_path, schema, row_factory=sqlite3.Row)
+
+    def _connect(self):
+        return self._db.get()
+
+    def _relpath(self, path: str):
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+
+    @staticmethod
+    def _insert(
+        conn: sqlite3.Connection,
+        path: str,
+        mtime: int,
+        size: int,
+        metadata: typing.Optional[MetadataOutput],
+    ):
+        conn.execute("DELETE FROM images WHERE path=?", (path,))
+        if metadata is None:
+            conn.execute(
+                "INSERT INTO images (path, mtime, size, has_metadata) VALUES (?, ?, ?, 0)",
+                (path, mtime, size),
+            )
+            return
+        conn.execute(
+            "INSERT INTO images (path, mtime, size, has_metadata, model_name, model_sha, "
+            "vae_name, vae_sha, seed, steps, cfg, sampler, scheduler, width, height, "
+            "positive, negative, metadata) "
+            "VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                path,
+                mtime,
+                size,
+                metadata["model"]["name"],
+                metadata["model"]["sha"],
+                metadata["vae"]["name"],
+                metadata["vae"]["sha"],
+                metadata["seed"],
+                metadata["steps"],
+                metadata["cfg"],
+                metadata["sampler"],
+                metadata["scheduler"],
+                metadata["width"],
+                metadata["height"],
+                ", ".join(metadata["positive"]),
+                ", ".join(metadata["negative"]),
+                json.dumps(metadata),
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO loras (path, name, sha, model_strength, clip_strength) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    path,
+                    lora["name"],
+                    lora.get("sha"),
+                    lora["model_strength"],
+                    lora["clip_strength"],
+                )
+                for lora in metadata["loras"]
+            ],
+        )
+
+    def record(self, path: str, metadata: MetadataOutput):
+        """Add or replace a single image, used by the writer after saving"""
+        try:
+            st = os.stat(path)
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    self._insert(
+                        conn, self._relpath(path), st.st_mtime_ns, st.st_size, metadata
+                    )
+        except (OSError, sqlite3.Error, KeyError, TypeError) as e:
+            warn("catalog update failed for %s: %s", path, e)
+
+    def scan(self):
+        """Index new and modified images and drop deleted ones"""
+        with self._lock:
+            known = {
+                row["path"]: (row["mtime"], row["size"])
+                for row in self._connect().execute(
+                    "SELECT path, mtime, size FROM images"
+                )
+            }
+        seen = set()
+        changed = []
+        for full_path in iter_image_files(self.root, catalog_extensions):
+            path = self._relpath(full_path)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            seen.add(path)
+            if known.get(path) != (st.st_mtime_ns, st.st_size):
+                changed.append((full_path, path, st.st_mtime_ns, st.st_size))
+
+        updated = 0
+        for start in range(0, len(changed), scan_batch_size):
+            batch = changed[start : start + scan_batch_size]
+            rows = []
+            for full_path, path, mtime, size in batch:
+                metadata = None
+                try:
+                    metadata_json = read_metadata(full_path)
+                    if metadata_json is not None:
+                        metadata = json.loads(metadata_json)
+                except Exception as e:
+                    warn("catalog could not read %s: %s", full_path, e)
+                rows.append((full_path, path, mtime, size, metadata))
+            # one transaction per batch keeps the lock short for record() and
+            # keeps progress if the process stops partway
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    for full_path, path, mtime, size, metadata in rows:
+                        if not self._unchanged(conn, full_path, path, mtime, size):
+                            # record() or the next scan has the newer state
+                            continue
+                        try:
+                            self._insert(conn, path, mtime, size, metadata)
+                        except (KeyError, TypeError):
+                            self._insert(conn, path, mtime, size, None)
+                        updated += 1
+
+        removed = [
+            path
+            for path in known
+            if path not in seen and not os.path.exists(os.path.join(self.root, path))
+        ]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "DELETE FROM images WHERE path=?", [(p,) for p in removed]
+                )
+        log("catalog scan: %d updated, %d removed", updated, len(removed))
+        return updated, len(removed)
+
+    def _unchanged(
+        self,
+        conn: sqlite3.Connection,
+        full_path: str,
+        path: str,
+        mtime: int,
+        size: int,
+    ):
+        """Whether the file still matches what the scan walked and no newer
+        row was recorded for it since"""
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return False
+        if (st.st_mtime_ns, st.st_size) != (mtime, size):
+            return False
+        row = conn.execute(
+            "SELECT mtime, size FROM images WHERE path=?", (path,)
+        ).fetchone()
+        # a row matching the walked state was written by record() meanwhile
+        return row is None or (row["mtime"], row["size"]) != (mtime, size)
+
+    def query(
+        self,
+        model: typing.Optional[str] = None,
+        vae: typing.Optional[str] = None,
+        lora: typing.Optional[str] = None,
+        seed: typing.Optional[int] = None,
+        steps: typing.Optional[int] = None,
+        cfg: typing.Optional[float] = None,
+        sampler: typing.Optional[str] = None,
+        scheduler: typing.Optional[str] = None,
+        positive: typing.Optional[str] = None,
+        negative: typing.Optional[str] = None,
+        limit: int = 100,
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Find images by generation parameters.
+
+        model, vae and lora match either the name or the sha; positive and
+        negative match a substring of the joined prompts."""
+        where = ["has_metadata=1"]
+        params: typing.List[typing.Any] = []
+        if model is not None:
+            where.append("(model_name=? OR model_sha=?)")
+            params += [model, model]
+        if vae is not None:
+            where.append("(vae_name=? OR vae_sha=?)")
+            params += [vae, vae]
+        if lora is not None:
+            where.append("path IN (SELECT path FROM loras WHERE name=? OR sha=?)")
+            params += [lora, lora]
+        for column, value in [
+            ("seed", seed),
+            ("steps", steps),
+            ("cfg", cfg),
+            ("sampler", sampler),
+            ("scheduler", scheduler),
+        ]:
+            if value is not None:
+                where.append(f"{column}=?")
+                params.append(value)
+        for column, value in [("positive", positive), ("negative", negative)]:
+            if value is not None:
+                where.append(f"instr({column}, ?) > 0")
+                params.append(value)
+        sql = (
+            f"SELECT path, metadata FROM images WHERE {' AND '.join(where)} "
+            "ORDER BY mtime DESC LIMIT ?"
+        )
+        params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [
+            {"path": row["path"], "metadata": json.loads(row["metadata"])}
+            for row in rows
+        ]
+
+
+_catalogs: typing.Dict[str, Catalog] = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(root: str):
+    root = os.path.abspath(root)
+    with _catalogs_lock:
+        if root not in _catalogs:
+            _catalogs[root] = Catalog(root)
+        return _catalogs[root]
@@ -0,0 +1,39 @@
+import os
+import sqlite3
+import typing
+
+
+class SharedConnection:
+    """WAL mode SQLite connection shared by the threads of one process.
+
+    Callers serialise access, including get(), with their own lock. The
+    connection is reopened in a forked child, since connections must not be
+    shared across a fork."""
+
+    def __init__(
+        self,
+        db_path: str,
+        schema: str,
+        row_factory: typing.Optional[typing.Callable] = None,
+    ):
+        self.db_path = db_path
+        self.schema = schema
+        self.row_factory = row_factory
+        self._conn: typing.Optional[sqlite3.Connection] = None
+        self._pid: typing.Optional[int] = None
+
+    def get(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(self.schema)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
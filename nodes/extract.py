@@ -0,0 +1,179 @@
+"""Bulk metadata extraction that never decodes pixel data.
+
+PNG files are read chunk by chunk, collecting tEXt, zTXt and iTXt chunks and
+seeking past the image data (which is only needed to find text chunks
+written after it). WebP files are walked through their RIFF chunk headers,
+seeking past the bitstream, and only the EXIF chunk is read.
+
+    python -m nodes.extract OUTPUT_DIR -o metadata.jsonl --workers 8
+
+From Python:
+
+    for record in iter_extract(iter_image_files(root)):
+        ...
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import typing
+import zlib
+
+import piexif
+
+png_signature = b"\x89PNG\r\n\x1a\n"
+image_extensions = (".png", ".webp")
+
+
+def read_png_text(
+    f: typing.BinaryIO, key: typing.Optional[str] = None
+) -> typing.Dict[str, str]:
+    """Text chunks of a PNG, seeking past the image data. With key, stop at
+    the image data if key was already found before it."""
+    if f.read(8) != png_signature:
+        raise ValueError("not a PNG file")
+    text: typing.Dict[str, str] = {}
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"IEND" or (chunk_type == b"IDAT" and key in text):
+            break
+        if chunk_type not in (b"tEXt", b"zTXt", b"iTXt"):
+            f.seek(length + 4, io.SEEK_CUR)
+            continue
+        data = f.read(length)
+        f.seek(4, io.SEEK_CUR)  # crc
+        key, _, rest = data.partition(b"\0")
+        keyword = key.decode("latin-1")
+        if chunk_type == b"tEXt":
+            text[keyword] = rest.decode("latin-1")
+        elif chunk_type == b"zTXt":
+            text[keyword] = zlib.decompress(rest[1:]).decode("latin-1")
+        else:
+            compressed = rest[0] == 1
+            _lang, _, rest = rest[2:].partition(b"\0")
+            _translated, _, value = rest.partition(b"\0")
+            if compressed:
+                value = zlib.decompress(value)
+            text[keyword] = value.decode("utf-8")
+    return text
+
+
+def read_webp_exif(f: typing.BinaryIO) -> typing.Optional[bytes]:
+    """Raw EXIF payload of a WebP file"""
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WEBP":
+        raise ValueError("not a WebP file")
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_type, length = struct.unpack("<4sI", chunk)
+        if chunk_type == b"EXIF":
+            data = f.read(length)
+            # some writers keep the jpeg style prefix
+            return data[6:] if data.startswith(b"Exif\0\0") else data
+        # chunks are padded to an even size
+        f.seek(length + (length & 1), io.SEEK_CUR)
+
+
+def exif_software(exif: bytes) -> typing.Optional[str]:
+    """The 0th IFD Software tag, where the writer stores its metadata JSON"""
+    value = piexif.load(exif)["0th"].get(piexif.ImageIFD.Software)
+    if value is None:
+        return None
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+
+def extract_metadata(path: str, key: str = "metadata") -> typing.Optional[str]:
+    """Metadata JSON written by the image writer, or None if there is none"""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "rb") as f:
+        if ext == ".png":
+            return read_png_text(f, key).get(key)
+        if ext == ".webp":
+            exif = read_webp_exif(f)
+            return exif_software(exif) if exif else None
+    raise ValueError(f"unsupported file type: {ext}")
+
+
+def extract_file(path: str) -> typing.Dict[str, typing.Any]:
+    """One JSONL record: path, parsed metadata and any error"""
+    record: typing.Dict[str, typing.Any] = {"path": path}
+    try:
+        metadata_json = extract_metadata(path)
+        record["metadata"] = json.loads(metadata_json) if metadata_json else None
+    except Exception as e:
+        record["metadata"] = None
+        record["error"] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def iter_image_files(
+    root: str, extensions: typing.Tuple[str, ...] = image_extensions
+) -> typing.Iterator[str]:
+    """Files under root with one of extensions, without following symlinked
+    directories"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.lower().endswith(extensions):
+                yield entry.path
+
+
+def iter_extract(
+    paths: typing.Iterable[str],
+    workers: typing.Optional[int] = None,
+    chunksize: int = 64,
+) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+    """Extract records across a process pool, yielding them as they finish
+    (not in input order). workers=1 runs in the calling process."""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(extract_file, paths)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(extract_file, paths, chunksize=chunksize)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Extract SQ writer metadata from PNG/WebP files as JSONL"
+    )
+    parser.add_argument("paths", nargs="+", help="image files or directories")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file, - for stdout")
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    def paths():
+        for path in args.paths:
+            if os.path.isdir(path):
+                yield from iter_image_files(path)
+            else:
+                yield path
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for record in iter_extract(paths(), args.workers, args.chunksize):
+            out.write(json.dumps(record) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
+import typing
 import folder_paths
 import comfy.sd
 import comfy.utils
 import torch
-from .utils import any_type, load_lora
-from .pure_utils import hash_var, log
+from .utils import any_type, load_lora, load_loras
+from .pure_utils import debug, file_identity, fingerprint, log, timed
+from .cache import LRUCache, default_cache_budget
+from .metrics import metrics
 from .types import LoraMetadata, LoraMetadataOutput, GeneratorForward
 import comfy.samplers
 
@@ -51,8 +54,7 @@ def list_vaes():
     return vaes
 
 
-def load_taesd(name):
-    sd = {}
+def taesd_paths(name):
     approx_vaes = folder_paths.get_filename_list("vae_approx")
 
     encoder = next(
@@ -61,16 +63,21 @@ def load_taesd(name):
     decoder = next(
         filter(lambda a: a.startswith("{}_decoder.".format(name)), approx_vaes)
     )
-
-    enc = comfy.utils.load_torch_file(
-        folder_paths.get_full_path_or_raise("vae_approx", encoder)
+    return (
+        folder_paths.get_full_path_or_raise("vae_approx", encoder),
+        folder_paths.get_full_path_or_raise("vae_approx", decoder),
     )
+
+
+def load_taesd(name, paths=None):
+    sd = {}
+    encoder_path, decoder_path = paths or taesd_paths(name)
+
+    enc = comfy.utils.load_torch_file(encoder_path)
     for k in enc:
         sd["taesd_encoder.{}".format(k)] = enc[k]
 
-    dec = comfy.utils.load_torch_file(
-        folder_paths.get_full_path_or_raise("vae_approx", decoder)
-    )
+    dec = comfy.utils.load_torch_file(decoder_path)
     for k in dec:
         sd["taesd_decoder.{}".format(k)] = dec[k]
 
@@ -89,6 +96,34 @@ def load_taesd(name):
     return sd
 
 
+def patcher_size(obj):
+    """Bytes held by a loaded MODEL, CLIP or VAE"""
+    if obj is None:
+        return 0
+    patcher = getattr(obj, "patcher", obj)
+    try:
+        return patcher.model_size()
+    except AttributeError:
+        return 0
+
+
+checkpoint_cache: LRUCache[tuple, tuple] = LRUCache(
+    max_bytes=default_cache_budget("SQ_CHECKPOINT_CACHE_MB", 0.25),
+    # patchers that cannot report their size count as 0 bytes
+    max_items=4,
+    sizeof=lambda out: sum(patcher_size(o) for o in out),
+)
+metrics.register_cache("checkpoint", checkpoint_cache)
+
+
+vae_cache: LRUCache[tuple, typing.Any] = LRUCache(
+    max_bytes=default_cache_budget("SQ_VAE_CACHE_MB", 0.05),
+    max_items=8,
+    sizeof=patcher_size,
+)
+metrics.register_cache("vae", vae_cache)
+
+
 class SQParameterGenerator:
     @classmethod
     def INPUT_TYPES(cls):
@@ -159,19 +194,29 @@ class SQCheckpointLoader:
     FUNCTION = "load"
     DESCRIPTION = "Load a checkpoint from parameter generator output"
 
+    @timed("SQCheckpointLoader.load")
     def load(self, ckpt_name):
         ckpt_path = folder_paths.get_full_path_or_raise("checkpoints", ckpt_name)
-        out = comfy.sd.load_checkpoint_guess_config(
-            ckpt_path,
-            output_vae=True,
-            output_clip=True,
-            embedding_directory=folder_paths.get_folder_paths("embeddings"),
-        )
-        log(
-            f"checkpoint loaded: {ckpt_name} {hash_var(str(out[0]))} {hash_var(str(out[1]))} {hash_var(str(out[2]))}"
+        key = (ckpt_name, file_identity(ckpt_path))
+        out = checkpoint_cache.get(key)
+        if out is None:
+            with timed("checkpoint_load"):
+                out = comfy.sd.load_checkpoint_guess_config(
+                    ckpt_path,
+                    output_vae=True,
+                    output_clip=True,
+                    embedding_directory=folder_paths.get_folder_paths("embeddings"),
+                )[:3]
+            checkpoint_cache.put(key, out)
+        log("checkpoint loaded: %s", ckpt_name)
+        debug(
+            "checkpoint fingerprints: %s %s %s",
+            fingerprint(out[0]),
+            fingerprint(out[1]),
+            fingerprint(out[2]),
         )
 
-        return out[:3]
+        return out
 
 
 class SQVaeLoader:
@@ -202,18 +247,28 @@ class SQVaeLoader:
     FUNCTION = "load"
     DESCRIPTION = "Load a VAE from parameter generator or reader output"
 
+    @timed("SQVaeLoader.load")
     def load(self, vae_name, built_in):
         if vae_name == builtin_vae:
-            log(f"vae loaded: built-in {hash_var(str(built_in))}")
+            log("vae loaded: built-in")
+            debug("vae fingerprint: %s", fingerprint(built_in))
             return (built_in,)
         if vae_name in ["taesd", "taesdxl", "taesd3", "taef1"]:
-            sd = load_taesd(vae_name)
+            paths = taesd_paths(vae_name)
+            load_sd = lambda: load_taesd(vae_name, paths)
         else:
-            vae_path = folder_paths.get_full_path_or_raise("vae", vae_name)
-            sd = comfy.utils.load_torch_file(vae_path)
-        vae = comfy.sd.VAE(sd=sd)
+            paths = (folder_paths.get_full_path_or_raise("vae", vae_name),)
+            load_sd = lambda: comfy.utils.load_torch_file(paths[0])
+        key = (vae_name,) + tuple(file_identity(p) for p in paths)
 
-        log(f"vae loaded: {vae_name} {hash_var(str(vae))}")
+        @timed("vae_load")
+        def create():
+            return comfy.sd.VAE(sd=load_sd())
+
+        vae = vae_cache.get_or_create(key, create)
+
+        log("vae loaded: %s", vae_name)
+        debug("vae fingerprint: %s", fingerprint(vae))
 
         return (vae,)
 
@@ -247,6 +302,7 @@ class SQLoraChainLoader:
     FUNCTION = "load"
     DESCRIPTION = "Load a Lora and chain outputs for storage as metadata. Pass chain to loras input of writer"
 
+    @timed("SQLoraChainLoader.load")
     def load(self, lora_name, model, clip, model_strength, clip_strength, chain=None):
         if model_strength == 0 and clip_strength == 0:
             return (model, clip, lora_name)
@@ -266,8 +322,9 @@ class SQLoraChainLoader:
         else:
             chain = chain + [param]
 
-        log(
-            f"lora loaded: {lora_name} {hash_var(str(model_lora))} {hash_var(str(clip_lora))}"
+        log("lora loaded: %s", lora_name)
+        debug(
+            "lora fingerprints: %s %s", fingerprint(model_lora), fingerprint(clip_lora)
         )
 
         return (model_lora, clip_lora, chain)
@@ -293,24 +350,21 @@ class SQLoraAutoLoader:
     FUNCTION = "load"
     DESCRIPTION = "Load all loras as specified in reader metadata. Pass in loras output from reader"
 
+    @timed("SQLoraAutoLoader.load")
     def load(self, loras, model, clip):
         ls: list[LoraMetadataOutput] = loras
-        model_lora = model
-        clip_lora = clip
-        log(f"loading loras: {ls}")
-        for l in ls:
-            if l["model_strength"] == 0 and l["clip_strength"] == 0:
-                continue
-            model_lora, clip_lora = load_lora(
-                model_lora,
-                clip_lora,
-                l["name"],
-                l["model_strength"],
-                l["clip_strength"],
-            )
-
-            log(
-                f"lora loaded: {l['name']} {hash_var(str(model_lora))} {hash_var(str(clip_lora))}"
-            )
+        log("loading loras: %s", [l["name"] for l in ls])
+        model_lora, clip_lora = load_loras(
+            model,
+            clip,
+            [
+                (l["name"], l["model_strength"], l["clip_strength"])
+                for l in ls
+                if l["model_strength"] != 0 or l["clip_strength"] != 0
+            ],
+        )
+        debug(
+            "lora fingerprints: %s %s", fingerprint(model_lora), fingerprint(clip_lora)
+        )
 
         return (model_lora, clip_lora)
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import typing
+from concurrent.futures import Future, ThreadPoolExecutor
+from .db import SharedConnection
+from .pure_utils import env_int, file_identity, log, timed, warn
+from .metrics import metrics
+
+default_db_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hash_cache.db"
+)
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+
+class HashStore:
+    """SQLite backed file hash cache shared between processes.
+
+    Entries are keyed on resolved path, size and mtime so a modified or
+    replaced file simply misses and gets rehashed."""
+
+    def __init__(self, db_path: str = default_db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = SharedConnection(db_path, schema)
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        return self._db.get()
+
+    def get(
+        self, key: typing.Tuple[str, int, int], count: bool = True
+    ) -> typing.Optional[str]:
+        path, size, mtime = key
+        try:
+            with self._lock:
+                row = (
+                    self._connect()
+                    .execute(
+                        "SELECT sha256 FROM hashes WHERE path=? AND size=? AND mtime=?",
+                        (path, size, mtime),
+                    )
+                    .fetchone()
+                )
+        except sqlite3.Error as e:
+            warn("hash cache read failed: %s", e)
+            row = None
+        if count:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row[0] if row else None
+
+    def put(self, key: typing.Tuple[str, int, int], sha256: str):
+        path, size, mtime = key
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO hashes (path, size, mtime, sha256) "
+                        "VALUES (?, ?, ?, ?)",
+                        (path, size, mtime, sha256),
+                    )
+        except sqlite3.Error as e:
+            warn("hash cache write failed: %s", e)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+hash_store = HashStore()
+metrics.register_cache("hash_store", hash_store)
+
+
+hash_block_size = env_int("SQ_HASH_BLOCK_KB", 4096, minimum=64) * 1024
+
+
+def sha256_file_size(filename: str, block_size: typing.Optional[int] = None):
+    """(sha256, bytes read) of a file, read unbuffered into a single reused
+    buffer"""
+    sha256 = hashlib.sha256()
+    if not block_size or block_size <= 0:
+        block_size = hash_block_size
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    size = 0
+
+    with open(filename, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            sha256.update(view[:n])
+            size += n
+
+    return sha256.hexdigest(), size
+
+
+def sha256_file(filename: str, block_size: typing.Optional[int] = None):
+    """sha256 of a file, read unbuffered into a single reused buffer"""
+    return sha256_file_size(filename, block_size)[0]
+
+
+_inflight: typing.Dict[typing.Tuple[str, int, int], Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def hash_file(filename: str, store: typing.Optional[HashStore] = None):
+    """Full sha256 of a file, served from the persistent store when unchanged.
+
+    Concurrent callers asking for the same file wait on the first caller's
+    result instead of reading it again."""
+    store = store or hash_store
+    key = file_identity(filename)
+    cached = store.get(key)
+    if cached:
+        return cached
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+    if not owner:
+        return future.result()
+
+    try:
+        # another caller may have finished between the lookup and the lock
+        hash_value = store.get(key, count=False)
+        if not hash_value:
+            with timed("hash_file"):
+                hash_value, size = sha256_file_size(key[0])
+            metrics.inc("hash_file.bytes", size)
+            # a file that changed while being read must not be persisted
+            # under its old identity
+            if size == key[1]:
+                store.put(key, hash_value)
+        future.set_result(hash_value)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+    return hash_value
+
+
+def hash_files(
+    filenames: typing.List[str],
+    workers: int = 4,
+    store: typing.Optional[HashStore] = None,
+):
+    """Hash several files at once; hashlib releases the GIL while digesting"""
+    if len(filenames) <= 1:
+        return [hash_file(f, store) for f in filenames]
+    with ThreadPoolExecutor(max_workers=min(workers, len(filenames))) as pool:
+        return list(pool.map(lambda f: hash_file(f, store), filenames))
+
+
+def prehash_files(
+    list_files: typing.Callable[[], typing.Iterable[str]],
+    workers: typing.Optional[int] = None,
+):
+    """Hash files in the background so the writer finds them cached.
+
+    Uses daemon threads so that an in-progress multi-GB read never holds up
+    shutdown."""
+    if workers is None:
+        workers = env_int("SQ_PREHASH_WORKERS", 2)
+    if workers <= 0:
+        return
+    pending: "queue.Queue[typing.Optional[str]]" = queue.Queue()
+
+    def work():
+        while True:
+            filename = pending.get()
+            if filename is None:
+                return
+            try:
+                hash_file(filename)
+            except Exception as e:
+                warn("prehash failed for %s: %s", filename, e)
+
+    def feed():
+        count = 0
+        try:
+            for filename in list_files():
+                pending.put(filename)
+                count += 1
+        except Exception as e:
+            warn("prehash listing failed: %s", e)
+        for _ in range(workers):
+            pending.put(None)
+        log("prehashing %d files", count)
+
+    for i in range(workers):
+        threading.Thread(target=work, name=f"sq-prehash-{i}", daemon=True).start()
+    threading.Thread(target=feed, name="sq-prehash-feed", daemon=True).start()
@@ -0,0 +1,86 @@
+import os
+import re
+import threading
+import typing
+import struct
+import zlib
+from PIL import Image
+from .extract import extract_metadata
+
+
+class IndexAllocator:
+    """Hands out output file indices without rescanning the directory.
+
+    Each (directory, extension) pair is scanned once to find the starting
+    index, after which the next index is kept in memory. Names are reserved
+    by creating the file exclusively, so writers in other threads or
+    processes can never be given the same file."""
+
+    def __init__(self):
+        self._next: typing.Dict[typing.Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _seed(directory: str, ext: str):
+        max_index = 0
+        file_count = 0
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.endswith(ext):
+                    file_count += 1
+                match = re.search(r"(\d+)", entry.name)
+                if match:
+                    max_index = max(max_index, int(match.group(1)))
+        return max(max_index, file_count) + 1
+
+    def reserve(
+        self,
+        directory: str,
+        ext: str,
+        format_name: typing.Callable[[int], str],
+    ):
+        """Create an empty file for the next free index, return (filename, path)"""
+        key = (os.path.realpath(directory), ext)
+        with self._lock:
+            if key not in self._next:
+                self._next[key] = self._seed(directory, ext)
+            previous = None
+            while True:
+                index = self._next[key]
+                self._next[key] += 1
+                filename = format_name(index)
+                if filename == previous:
+                    # template has no index placeholder, disambiguate with a suffix
+                    stem, file_ext = os.path.splitext(filename)
+                    filename = f"{stem}_{index}{file_ext}"
+                else:
+                    previous = filename
+                path = os.path.join(directory, filename)
+                try:
+                    fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+                except FileExistsError:
+                    continue
+                os.close(fd)
+                return filename, path
+
+
+index_allocator = IndexAllocator()
+
+
+def read_metadata(path: str) -> typing.Optional[str]:
+    """Metadata JSON embedded by the writer, without decoding pixel data"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext in [".png", ".webp"]:
+        try:
+            # finds text chunks on either side of the image data
+            return extract_metadata(path)
+        except (ValueError, struct.error, zlib.error):
+            pass
+    # let PIL handle other formats and files the chunk reader rejects
+    with Image.open(path) as img:
+        if ext == ".png":
+            return img.info.get("metadata")
+        elif ext in [".jpg", ".jpeg", ".webp"]:
+            software = img.getexif().get(0x0131)
+            return str(software) if software is not None else None
+    return None
@@ -0,0 +1,130 @@
+import bisect
+import threading
+import typing
+
+default_buckets = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets: typing.Sequence[float] = default_buckets):
+        self.buckets = tuple(buckets)
+        # last slot counts observations above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        out = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            out.append((bound, total))
+        return out
+
+
+class Metrics:
+    """In-process counters, latency histograms and registered cache stats"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: typing.Dict[str, int] = {}
+        self.histograms: typing.Dict[str, Histogram] = {}
+        self.caches: typing.Dict[str, typing.Any] = {}
+
+    def inc(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def register_cache(self, name: str, cache):
+        """cache must provide stats() returning hits, misses and friends"""
+        self.caches[name] = cache
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {
+                name: {
+                    "count": h.count,
+                    "sum": h.sum,
+                    "mean": h.sum / h.count if h.count else 0.0,
+                    "buckets": {
+                        ("+Inf" if bound == float("inf") else str(bound)): count
+                        for bound, count in h.cumulative()
+                    },
+                }
+                for name, h in self.histograms.items()
+            }
+        caches = {}
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+            caches[name] = stats
+        return {"counters": counters, "timings": histograms, "caches": caches}
+
+    def prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+
+        def label(value: str):
+            return value.replace("\\", "\\\\").replace('"', '\\"')
+
+        lines.append("# TYPE sq_events_total counter")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f'sq_events_total{{event="{label(name)}"}} {value}')
+
+        lines.append("# TYPE sq_operation_seconds histogram")
+        for name, h in sorted(snapshot["timings"].items()):
+            op = label(name)
+            for bound, count in h["buckets"].items():
+                lines.append(
+                    f'sq_operation_seconds_bucket{{operation="{op}",le="{bound}"}} {count}'
+                )
+            lines.append(f'sq_operation_seconds_sum{{operation="{op}"}} {h["sum"]}')
+            lines.append(f'sq_operation_seconds_count{{operation="{op}"}} {h["count"]}')
+
+        for stat, kind in [
+            ("hits", "counter"),
+            ("misses", "counter"),
+            ("evictions", "counter"),
+            ("items", "gauge"),
+            ("bytes", "gauge"),
+            ("hit_rate", "gauge"),
+        ]:
+            metric = (
+                f"sq_cache_{stat}_total" if kind == "counter" else f"sq_cache_{stat}"
+            )
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, stats in sorted(snapshot["caches"].items()):
+                if stat in stats:
+                    lines.append(f'{metric}{{cache="{label(name)}"}} {stats[stat]}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -1,27 +1,104 @@
 import copy
+import math
 import re
+import weakref
 from typing import Any, Optional
 from server import PromptServer
 import torch
+import comfy.model_management
 from .utils import any_type
-from .pure_utils import hash_var, parse_text, log
+from .pure_utils import debug, env_int, fingerprint, parse_text, timed
+from .cache import LRUCache
+from .metrics import metrics
 from .types import PromptChain
 
 
+def repeat_batch(t: torch.Tensor, batch_size: int):
+    if t.shape[0] == batch_size:
+        return t
+    return t.repeat((batch_size // t.shape[0],) + (1,) * (t.ndim - 1))
+
+
 def concat_cond(cond1, cond2):
     out = []
     for i in range(len(cond1)):
         t1 = cond1[i][0]
-        tw = torch.cat((t1, cond2[0][0]), 1)
+        t2 = cond2[0][0]
+        # a single prompt is broadcast against a batch of variants
+        batch_size = max(t1.shape[0], t2.shape[0])
+        tw = torch.cat((repeat_batch(t1, batch_size), repeat_batch(t2, batch_size)), 1)
         n = [tw, cond1[i][1].copy()]
         out.append(n)
     return out
 
 
+def batch_conds(conds):
+    """Stack single entry conditionings along the batch axis. Shorter token
+    sequences are repeated to a common length as ComfyUI does when batching"""
+    tensors = [c[0][0] for c in conds]
+    length = math.lcm(*[t.shape[1] for t in tensors])
+    cond = torch.cat([t.repeat(1, length // t.shape[1], 1) for t in tensors], 0)
+    output = conds[0][0][1].copy()
+    pooled = [c[0][1].get("pooled_output") for c in conds]
+    if all(p is not None for p in pooled):
+        output["pooled_output"] = torch.cat(pooled, 0)
+    return [[cond, output]]
+
+
+def concat_conds(conds):
+    """Same result as folding concat_cond over conds, with one cat per entry"""
+    if len(conds) == 1:
+        return conds[0]
+    out = []
+    for i in range(len(conds[0])):
+        tw = torch.cat([conds[0][i][0]] + [c[0][0] for c in conds[1:]], 1)
+        out.append([tw, conds[0][i][1].copy()])
+    return out
+
+
+def clip_cache_budget():
+    """SQ_CLIP_CACHE_MB, else 2% of the memory of the device that holds
+    encoded conditioning"""
+    mb = env_int("SQ_CLIP_CACHE_MB", -1)
+    if mb >= 0:
+        return mb * 1024 * 1024
+    device = comfy.model_management.intermediate_device()
+    return int(comfy.model_management.get_total_memory(device) * 0.02)
+
+
+def cond_size(entry):
+    _, cond, output = entry
+    return cond.nbytes + sum(
+        v.nbytes for v in output.values() if isinstance(v, torch.Tensor)
+    )
+
+
+cond_cache: LRUCache[tuple, tuple] = LRUCache(
+    max_bytes=clip_cache_budget(), sizeof=cond_size
+)
+metrics.register_cache("clip", cond_cache)
+
+
+def clip_identity(clip):
+    """Changes whenever the text encoder, its lora patches or clip skip do"""
+    return (
+        id(clip.cond_stage_model),
+        getattr(clip.patcher, "patches_uuid", None),
+        getattr(clip, "layer_idx", None),
+    )
+
+
 def encode_cond(clip, text):
-    tokens = clip.tokenize(text)
-    output = clip.encode_from_tokens(tokens, return_pooled=True, return_dict=True)
+    key = (clip_identity(clip), text)
+    cached = cond_cache.get(key)
+    # ids can be reused once a model is freed, so check it is the same object
+    if cached is not None and cached[0]() is clip.cond_stage_model:
+        return [[cached[1], cached[2].copy()]]
+    with timed("clip_encode"):
+        tokens = clip.tokenize(text)
+        output = clip.encode_from_tokens(tokens, return_pooled=True, return_dict=True)
     cond = output.pop("cond")
+    cond_cache.put(key, (weakref.ref(clip.cond_stage_model), cond, output.copy()))
     return [[cond, output]]
 
 
@@ -42,6 +119,15 @@ class SQChainPrompt:
             "optional": {
                 "chain": (any_type,),
                 "clip": ("CLIP",),
+                "variants": (
+                    "INT",
+                    {
+                        "default": 1,
+                        "min": 1,
+                        "max": 64,
+                        "tooltip": "Number of {|} expansions to encode as a batch. Use with a matching latent batch size",
+                    },
+                ),
             },
         }
 
@@ -52,38 +138,68 @@ class SQChainPrompt:
     DESCRIPTION = "Chain prompts with conditioning concat for longer attention. Pass prompts output to pos/neg writer input"
 
     @classmethod
-    def IS_CHANGED(cls, prompt, clip=None, chain=None):
+    def IS_CHANGED(cls, prompt, clip=None, chain=None, variants=1):
         if re.search(r"[{}]", prompt):
             return float("NaN")
         return 0
 
+    @timed("SQChainPrompt.parse")
     def parse(
         self,
         prompt: str,
         clip: Any = None,
         chain: Optional[PromptChain] = None,
+        variants: int = 1,
     ):
         # parse prompt
-        text = parse_text(prompt)
+        texts = [parse_text(prompt) for _ in range(variants)]
+        text = texts[0]
         # get clip
         if chain is not None and clip is None:
             clip = chain["clip"]
-        conditioning = encode_cond(clip, text)
+        conds = [encode_cond(clip, t) for t in texts]
         # chain prompts
         if chain is None:
-            chain = {"prompts": [text], "conditioning": conditioning, "clip": clip}
-            new_cond = conditioning
+            chain = {"prompts": [text], "clip": clip}
+            variant_conds = conds
+            if variants > 1:
+                chain["variants"] = [[t] for t in texts]
         else:
-            new_cond = concat_cond(chain["conditioning"], conditioning)
+            previous = chain.get("variants") or [chain["prompts"]]
+            if len(previous) > 1 and variants > 1 and len(previous) != variants:
+                raise ValueError(
+                    f"cannot chain {variants} prompt variants onto {len(previous)}"
+                )
+            previous_conds = chain.get("variant_conds") or [chain["conditioning"]]
+            count = max(len(previous), variants)
+            # concatenate each variant unpadded, so it matches what
+            # SQAutoPrompt rebuilds from that variant's prompts
+            variant_conds = [
+                concat_cond(
+                    previous_conds[i % len(previous_conds)], conds[i % len(conds)]
+                )
+                for i in range(count)
+            ]
             chain = {
                 # shallow copy is fine because strings are immutable
                 "prompts": chain["prompts"].copy(),
-                "conditioning": new_cond,
                 "clip": clip,
             }
             chain["prompts"].append(text)
+            if count > 1:
+                chain["variants"] = [
+                    previous[i % len(previous)] + [texts[i % len(texts)]]
+                    for i in range(count)
+                ]
+        if len(variant_conds) > 1:
+            # only the node output is padded to a common length for batching
+            new_cond = batch_conds(variant_conds)
+            chain["variant_conds"] = variant_conds
+        else:
+            new_cond = variant_conds[0]
+        chain["conditioning"] = new_cond
 
-        log(f"prompt loaded {text[:8]}... {hash_var(str(new_cond))}")
+        debug("prompt loaded %s... %s", text[:8], fingerprint(new_cond))
 
         return chain, new_cond, chain["prompts"]
 
@@ -104,13 +220,14 @@ class SQAutoPrompt:
     FUNCTION = "parse"
     DESCRIPTION = "Load all prompts as specified in reader metadata. Pass in pos/neg output from reader"
 
+    @timed("SQAutoPrompt.parse")
     def parse(self, prompts: list[str], clip):
-        conditioning = encode_cond(clip, prompts[0])
-        log(f"prompt loaded: {prompts[0][:8]}... {hash_var(str(conditioning))}")
-        for p in prompts[1:]:
-            conditioning = concat_cond(conditioning, encode_cond(clip, p))
-
-            log(f"prompt loaded: {p[:8]}... {hash_var(str(conditioning))}")
+        conditioning = concat_conds([encode_cond(clip, p) for p in prompts])
+        debug(
+            "prompts loaded: %s %s",
+            [p[:8] + "..." for p in prompts],
+            fingerprint(conditioning),
+        )
 
         return (conditioning,)
 
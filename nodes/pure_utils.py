@@ -1,31 +1,89 @@
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import os
 import random
 import re
-import hashlib
+import time
+import typing
 
 import numpy
+from .metrics import metrics
 
 
-def parse_text(text: str):
-    while True:
-        match = re.search(r"\{([^\{\}]*)\}", text)
-        if match is None:
-            break
-        options = match.group(1).split("|")
-        weights = []
-        for i in range(len(options)):
-            o = options[i].strip()
-            weight_match = re.search(r"\s*^(\d*\.?\d*):", o)
+class Group:
+    """A {a|b|c} choice; each option is a list of literal strings and groups"""
+
+    __slots__ = ("options", "weights")
+
+    def __init__(self, options: list, weights: list):
+        self.options = options
+        self.weights = weights
+
+
+def _make_group(options: list):
+    weights = []
+    for nodes in options:
+        weight = 1
+        if nodes and isinstance(nodes[0], str):
+            weight_match = re.match(r"\s*(\d+\.?\d*|\.\d+):", nodes[0])
             if weight_match:
                 weight = float(weight_match.group(1))
-                options[i] = o.replace(weight_match.group(0), "")
-                weights.append(weight)
-            else:
-                weights.append(1)
-        log(weights)
-        choice = random.choices(options, weights, k=1)[0]
-        text = text.replace(match.group(0), choice, 1)
-    if re.search(r"[{}]", text):
+                # weighted options are stripped like the rest of the option
+                nodes[0] = nodes[0][weight_match.end() :]
+                if isinstance(nodes[-1], str):
+                    nodes[-1] = nodes[-1].rstrip()
+        weights.append(weight)
+    return Group(options, weights)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_template(text: str):
+    """Parse a prompt with nested {a|b} groups into a list of nodes"""
+    root: list = []
+    current = root
+    stack: list = []
+    for token in re.split(r"([{}|])", text):
+        if token == "{":
+            options: list = [[]]
+            stack.append((current, options))
+            current = options[0]
+        elif token == "|" and stack:
+            options = stack[-1][1]
+            options.append([])
+            current = options[-1]
+        elif token == "}":
+            if not stack:
+                raise ValueError("Brackets are not matching")
+            current, options = stack.pop()
+            current.append(_make_group(options))
+        elif token:
+            current.append(token)
+    if stack:
         raise ValueError("Brackets are not matching")
+    return root
+
+
+def sample_template(nodes: list):
+    out = []
+    stack = [iter(nodes)]
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, str):
+                out.append(node)
+            else:
+                choice = random.choices(node.options, node.weights, k=1)[0]
+                stack.append(iter(choice))
+                break
+        else:
+            stack.pop()
+    return "".join(out)
+
+
+def parse_text(text: str):
+    text = sample_template(compile_template(text))
     s = text.split(",")
     s = map(str.strip, s)
     s = filter(bool, s)
@@ -40,8 +98,97 @@ def hash_var(var: str):
     return hash_value
 
 
-def log(msg):
-    print(f"[SQNodes] {msg}")
+def file_identity(path: str):
+    """(resolved path, size, mtime) tuple that changes whenever the file does"""
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return path, st.st_size, st.st_mtime_ns
+
+
+def env_int(name: str, default: int, minimum: typing.Optional[int] = None):
+    """Integer env var, falling back to default if unset, invalid or below
+    minimum"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        result = int(value)
+    except ValueError:
+        warn("ignoring invalid %s=%r", name, value)
+        return default
+    if minimum is not None and result < minimum:
+        warn("ignoring %s=%r, must be at least %d", name, value, minimum)
+        return default
+    return result
+
+
+logger = logging.getLogger("SQNodes")
+log_level = os.environ.get("SQ_LOG_LEVEL", "INFO").upper()
+if isinstance(logging.getLevelName(log_level), int):
+    logger.setLevel(log_level)
+else:
+    logger.setLevel(logging.INFO)
+    logger.warning("[SQNodes] ignoring unknown SQ_LOG_LEVEL=%r", log_level)
+
+
+def log(msg, *args, level: int = logging.INFO):
+    """Log through the SQNodes logger. %-style args are only formatted if the
+    level is enabled, so pass expensive values as args rather than f-strings"""
+    if logger.isEnabledFor(level):
+        logger.log(level, f"[SQNodes] {msg}", *args)
+
+
+def debug(msg, *args):
+    log(msg, *args, level=logging.DEBUG)
+
+
+def warn(msg, *args):
+    log(msg, *args, level=logging.WARNING)
+
+
+class fingerprint:
+    """Short hash of str(obj), computed only when the log line is formatted"""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return hash_var(str(self.obj))
+
+
+class timed(contextlib.ContextDecorator):
+    """Record the duration of a node or operation in the metrics registry and
+    emit a structured timing record at debug level"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def _recreate_cm(self):
+        # a fresh instance per decorated call keeps concurrent calls apart
+        return timed(self.name)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        metrics.observe(self.name, seconds)
+        if exc_type is not None:
+            metrics.inc(f"{self.name}.errors")
+        if logger.isEnabledFor(logging.DEBUG):
+            record = {
+                "event": "timing",
+                "name": self.name,
+                "seconds": round(seconds, 6),
+                "ok": exc_type is None,
+            }
+            logger.debug(
+                "[SQNodes] %s", json.dumps(record), extra={"sq_record": record}
+            )
+        return False
 
 
 if __name__ == "__main__":
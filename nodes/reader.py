@@ -8,9 +8,52 @@ import torch
 import folder_paths
 from .utils import any_type
 from .types import MetadataOutput
-from .pure_utils import log
+from .pure_utils import debug, env_int, file_identity, log, timed
+from .cache import LRUCache
+from .image_io import read_metadata
+from .workflow_store import read_workflow
+from .metrics import metrics
 import comfy.samplers
 
+read_cache: LRUCache[tuple, tuple] = LRUCache(
+    max_bytes=env_int("SQ_READER_CACHE_MB", 512, minimum=0) * 1024 * 1024,
+    sizeof=lambda v: len(v[0]) + v[1].nbytes,
+)
+metrics.register_cache("reader", read_cache)
+
+
+def resolve_filepath(filepath: str):
+    if filepath.startswith("."):
+        filepath = os.path.join(folder_paths.get_output_directory(), filepath)
+    return filepath
+
+
+@timed("reader_decode")
+def load_file(filepath: str, load_image: str = "true"):
+    """Parse the embedded metadata and optionally decode the image"""
+    if load_image != "true":
+        metadata_json = read_metadata(filepath)
+        if metadata_json is None:
+            raise ValueError("No compatible metadata found")
+        return metadata_json, torch.zeros((1, 64, 64, 3), dtype=torch.float32)
+    metadata_json = None
+    with open(filepath, "rb") as f:
+        img = Image.open(f)
+        img.load()
+        if re.search(r"\.png$", filepath):
+            metadata_json = img.info.get("metadata")
+        elif re.search(r"\.(jpe?g|webp)$", filepath):
+            exif = img.getexif()
+            metadata_json = str(exif[0x0131])
+        img = ImageOps.exif_transpose(img)
+        assert img is not None
+        image = img.convert("RGB")
+        image = np.array(image).astype(np.float32) / 255.0
+        image = torch.from_numpy(image)[None,]
+    if metadata_json is None:
+        raise ValueError("No compatible metadata found")
+    return metadata_json, image
+
 
 class SQImageReader:
     @classmethod
@@ -25,6 +68,22 @@ class SQImageReader:
                     },
                 ),
             },
+            "optional": {
+                "load_image": (
+                    ["true", "false"],
+                    {
+                        "default": "true",
+                        "tooltip": "Decode the image pixels. When false only metadata is parsed and image is an empty 64x64 image",
+                    },
+                ),
+                "load_workflow": (
+                    ["false", "true"],
+                    {
+                        "default": "false",
+                        "tooltip": "Output the ComfyUI prompt and workflow of the image, resolving them from the workflow store if the image only references them",
+                    },
+                ),
+            },
         }
 
     RETURN_TYPES = (
@@ -43,6 +102,7 @@ class SQImageReader:
         any_type,
         "IMAGE",
         "STRING",
+        any_type,
     )
     RETURN_NAMES = (
         "model_name",
@@ -60,39 +120,42 @@ class SQImageReader:
         "forward",
         "image",
         "filename",
+        "workflow",
     )
     OUTPUT_NODE = True
     CATEGORY = "SQNodes"
     FUNCTION = "read"
     DESCRIPTION = "Save images with reusable generation metadata"
 
-    def read(self, filepath: str):
-        log(f"File: {filepath}")
-        if filepath.startswith("."):
-            filepath = os.path.join(folder_paths.get_output_directory(), filepath)
-        with open(filepath, "rb") as f:
-            img = Image.open(f)
-            img.load()
-            img = ImageOps.exif_transpose(img)
-            assert img is not None
-            image = img.convert("RGB")
-            image = np.array(image).astype(np.float32) / 255.0
-            image = torch.from_numpy(image)[None,]
-            if re.search(r"\.png$", filepath):
-                info = img.info
-                metadata_json = info.get("metadata")
-            elif re.search(r"\.(jpe?g|webp)$", filepath):
-                exif = img.getexif()
-                metadata_json = str(exif[0x0131])
-        if metadata_json is None:
-            raise ValueError("No compatible metadata found")
+    @classmethod
+    def IS_CHANGED(
+        cls, filepath: str, load_image: str = "true", load_workflow: str = "false"
+    ):
+        try:
+            return str(file_identity(resolve_filepath(filepath)))
+        except OSError:
+            return float("NaN")
+
+    @timed("SQImageReader.read")
+    def read(
+        self, filepath: str, load_image: str = "true", load_workflow: str = "false"
+    ):
+        log("File: %s", filepath)
+        filepath = resolve_filepath(filepath)
+        identity = file_identity(filepath)
+        # a fully decoded entry also serves metadata-only reads
+        key = (identity, "true" if (identity, "true") in read_cache else load_image)
+        metadata_json, image = read_cache.get_or_create(
+            key, lambda: load_file(filepath, key[1])
+        )
         metadata: MetadataOutput = json.loads(metadata_json)
-        log(metadata)
+        debug("metadata: %s", metadata_json)
 
         model_name = metadata["model"]["name"]
         vae_name = metadata["vae"]["name"]
         loras = metadata["loras"]
         filename = os.path.basename(filepath)
+        workflow = read_workflow(filepath) if load_workflow == "true" else None
 
         return (
             model_name,
@@ -110,4 +173,5 @@ class SQImageReader:
             metadata,
             image,
             filename,
+            workflow,
         )
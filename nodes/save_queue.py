@@ -0,0 +1,106 @@
+import atexit
+import multiprocessing
+import threading
+import typing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from .pure_utils import env_int, warn
+
+
+class SaveQueue:
+    """Bounded background queue for image writes.
+
+    submit() blocks once `max_pending` jobs are queued or running, so a fast
+    sampler cannot buffer an unbounded number of frames in memory. Pending
+    jobs are flushed when the interpreter exits."""
+
+    def __init__(
+        self,
+        workers: int = 2,
+        max_pending: int = 8,
+        worker_type: typing.Literal["thread", "process"] = "thread",
+    ):
+        if workers < 1 or max_pending < 1:
+            raise ValueError("workers and max_pending must be at least 1")
+        self.workers = workers
+        self.worker_type = worker_type
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending: typing.Set[Future] = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._executor: typing.Optional[Executor] = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if (
+                self.worker_type == "process"
+                and "fork" in multiprocessing.get_all_start_methods()
+            ):
+                # workers must inherit the already imported node modules. A
+                # fork also inherits locks held by other threads, so jobs must
+                # not take any (see encode_frame)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                )
+            else:
+                if self.worker_type == "process":
+                    warn("process save workers need fork, using threads")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="sq-save"
+                )
+        return self._executor
+
+    def submit(
+        self,
+        fn,
+        *args,
+        on_done: typing.Optional[typing.Callable[[Future], None]] = None,
+        **kwargs,
+    ):
+        """Run fn(*args, **kwargs) in the background. on_done is called with the
+        finished future in this process, before flush() counts the job done."""
+        self._slots.acquire()
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda f: self._done(f, on_done))
+        return future
+
+    def _done(self, future: Future, on_done):
+        try:
+            if on_done is not None:
+                on_done(future)
+        except Exception as e:
+            warn("background save callback failed: %s", e)
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+                if not self._pending:
+                    self._idle.notify_all()
+            self._slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            warn("background save failed: %s", future.exception())
+
+    def flush(self):
+        """Wait until every submitted job and its on_done callback finished"""
+        with self._lock:
+            while self._pending:
+                self._idle.wait()
+
+    def shutdown(self):
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+save_queue = SaveQueue(
+    workers=env_int("SQ_SAVE_WORKERS", 2, minimum=1),
+    max_pending=env_int("SQ_SAVE_QUEUE_SIZE", 8, minimum=1),
+    worker_type="process" if env_int("SQ_SAVE_PROCESSES", 0) else "thread",
+)
+atexit.register(save_queue.shutdown)
@@ -26,12 +26,19 @@ class GeneratorForward(typing.TypedDict):
     scheduler: str
 
 
-class PromptChain(typing.TypedDict):
+class PromptChainBase(typing.TypedDict):
     prompts: list[str]
     conditioning: typing.Any
     clip: typing.Any
 
 
+class PromptChain(PromptChainBase, total=False):
+    # prompts of each batch entry when expanding several variants
+    variants: list[list[str]]
+    # unpadded conditioning of each variant, batched into conditioning
+    variant_conds: list[typing.Any]
+
+
 class MetadataOutput(typing.TypedDict):
     model: ModelMetadataOutput
     vae: ModelMetadataOutput
@@ -1,22 +1,39 @@
-import hashlib
 import piexif
 import piexif.helper
 import json
 from PIL.PngImagePlugin import PngInfo
 import typing
+from concurrent.futures import ThreadPoolExecutor
 import folder_paths
 import torch
 import os
 import re
+import threading
+import time
 import datetime
+import logging
 from typing import Optional
 from PIL import Image, ExifTags
 import numpy as np
 from .types import MetadataOutput
+from .hashing import hash_files, prehash_files
+from .image_io import index_allocator
+from .save_queue import SaveQueue
+from .catalog import get_catalog
+from .workflow_store import get_workflow_store, refs_key
+from .cache import LRUCache, default_cache_budget, state_dict_size
+from .metrics import metrics
+from .pure_utils import env_int, file_identity, timed
 from comfy.cli_args import args
+import comfy.lora
 import comfy.sd
 import comfy.utils
 
+try:
+    from comfy.lora_convert import convert_lora
+except ImportError:
+    convert_lora = None
+
 
 class AnyType(str):
     """A special type that can be connected to any other types. Credit to pythongosssss"""
@@ -38,14 +55,7 @@ def format_filename(filename: str, index: int, timestamp_format: Optional[str] =
     return filename
 
 
-def calculate_hash(
-    cache: typing.Dict[str, str],
-    name: str,
-    file_type: typing.Literal["model", "vae", "lora"],
-):
-    cached = cache.get(name)
-    if cached:
-        return cached
+def resolve_model_path(name: str, file_type: typing.Literal["model", "vae", "lora"]):
     if file_type == "model":
         filename = folder_paths.get_full_path("checkpoints", name)
     elif file_type == "vae":
@@ -54,17 +64,66 @@ def calculate_hash(
         filename = folder_paths.get_full_path("loras", name)
     if not filename:
         raise FileNotFoundError(f"File not found: {file_type} {name}")
-    sha256 = hashlib.sha256()
-    blksize = 1024 * 1024
+    return filename
+
+
+def calculate_hash(
+    cache: typing.Dict[typing.Tuple[str, int, int], str],
+    name: str,
+    file_type: typing.Literal["model", "vae", "lora"],
+):
+    return calculate_hashes(cache, [name], file_type)[0]
+
+
+def calculate_hashes(
+    cache: typing.Dict[typing.Tuple[str, int, int], str],
+    names: typing.List[str],
+    file_type: typing.Literal["model", "vae", "lora"],
+):
+    keys = [file_identity(resolve_model_path(name, file_type)) for name in names]
+    missing = list(dict.fromkeys(key for key in keys if not cache.get(key)))
+    hashes = hash_files([key[0] for key in missing])
+    for key, hash_value in zip(missing, hashes):
+        cache[key] = hash_value[:10]
+
+    return [cache[key] for key in keys]
+
+
+def list_hashable_files():
+    for folder_name in ["checkpoints", "vae", "loras"]:
+        for name in folder_paths.get_filename_list(folder_name):
+            filename = folder_paths.get_full_path(folder_name, name)
+            if filename:
+                yield filename
+
+
+def start_prehash():
+    prehash_files(list_hashable_files)
+
+
+encode_pool = ThreadPoolExecutor(
+    max_workers=env_int("SQ_ENCODE_WORKERS", min(8, os.cpu_count() or 1), minimum=1),
+    thread_name_prefix="sq-encode",
+)
 
-    with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(blksize), b""):
-            sha256.update(chunk)
 
-    hash_value = sha256.hexdigest()[:10]
-    cache[name] = hash_value
+def quantize_images(images: torch.Tensor) -> np.ndarray:
+    """Convert a float IMAGE batch to uint8 host memory.
 
-    return hash_value
+    On an accelerator the whole batch is quantized on its device and copied
+    in one transfer. CPU batches are quantized frame by frame through one
+    reused float buffer, so the extra memory is a single float frame rather
+    than a float copy of the batch."""
+    with timed("image_quantize"), torch.no_grad():
+        if images.device.type != "cpu":
+            pixels = images.mul(255.0).clamp_(0, 255).to(torch.uint8)
+            return pixels.cpu().numpy()
+        out = torch.empty(images.shape, dtype=torch.uint8)
+        buf = torch.empty(images.shape[1:], dtype=images.dtype)
+        for frame, pixels in zip(images, out):
+            torch.mul(frame, 255.0, out=buf).clamp_(0, 255)
+            pixels.copy_(buf)
+        return out.numpy()
 
 
 def save_image(
@@ -77,26 +136,166 @@ def save_image(
     final: bool = False,
     compress_level: int = 4,
     timestamp_format: Optional[str] = None,
+    compress_metadata: bool = False,
+    store_workflow: bool = False,
 ):
+    return save_images(
+        image[None,],
+        directory,
+        filename,
+        prompt,
+        extra_pnginfo,
+        [metadata],
+        final=final,
+        compress_level=compress_level,
+        compress_metadata=compress_metadata,
+        store_workflow=store_workflow,
+        timestamp_format=timestamp_format,
+    )[0]
+
+
+def save_images(
+    images: torch.Tensor,
+    directory: str,
+    filename: str,
+    prompt,
+    extra_pnginfo,
+    metadata: typing.List[MetadataOutput],
+    final: bool = False,
+    compress_level: int = 4,
+    timestamp_format: Optional[str] = None,
+    queue: Optional[SaveQueue] = None,
+    compress_metadata: bool = False,
+    store_workflow: bool = False,
+):
+    """Save each frame of a batch with its own metadata, encoding in parallel.
+
+    With a queue the frames are handed to it and the reserved filenames are
+    returned straight away, before the files are written. With store_workflow
+    the prompt and workflow go to the workflow store once and the frames only
+    embed their digests."""
     output_path = os.path.join(folder_paths.get_output_directory(), directory)
     os.makedirs(output_path, exist_ok=True)
     ext = os.path.splitext(filename)[1].lower()
-    files = os.listdir(output_path)
-    file_count = len(list(filter(lambda x: x.endswith(ext), files)))
-    max_index = map(lambda x: re.search(r"(\d+)", x), files)
-    file_index = (
-        max([int(match.group(1)) for match in max_index if match] + [0] + [file_count])
-        + 1
-    )
-    filename = format_filename(filename, file_index, timestamp_format)
-    i = 255.0 * image.cpu().numpy()
-    img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-
-    save_path = os.path.join(output_path, filename)
-    while os.path.exists(save_path):
-        file_index += 1
-        filename = format_filename(filename, file_index, timestamp_format)
-        save_path = os.path.join(output_path, filename)
+
+    template = filename
+    frames = []
+    for pixels in quantize_images(images):
+        # reserve sequentially so indices follow batch order
+        frame_filename, save_path = index_allocator.reserve(
+            output_path,
+            ext,
+            lambda index: format_filename(template, index, timestamp_format),
+        )
+        frames.append((pixels, frame_filename, save_path))
+
+    if store_workflow and not final and not args.disable_metadata:
+        store = get_workflow_store(folder_paths.get_output_directory())
+        refs = store.put_workflow(prompt, extra_pnginfo)
+        prompt, extra_pnginfo = None, {refs_key: refs}
+
+    jobs = [
+        (pixels, save_path, frame_filename, prompt, extra_pnginfo, frame_metadata)
+        for (pixels, frame_filename, save_path), frame_metadata in zip(frames, metadata)
+    ]
+    options = {
+        "final": final,
+        "compress_level": compress_level,
+        "compress_metadata": compress_metadata,
+    }
+    catalog = get_catalog(folder_paths.get_output_directory())
+
+    def record_when_saved(job):
+        # runs in this process, the save worker may be a forked process
+        def callback(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                metrics.inc("image_write.errors")
+                return
+            metrics.observe("image_write", future.result())
+            catalog.record(job[1], job[5])
+
+        return callback
+
+    if queue is not None:
+        for job in jobs:
+            queue.submit(encode_frame, *job, on_done=record_when_saved(job), **options)
+        return [job[2] for job in jobs]
+    if len(jobs) == 1:
+        filenames = [write_frame(*jobs[0], **options)]
+    else:
+        futures = [encode_pool.submit(write_frame, *job, **options) for job in jobs]
+        filenames = [f.result() for f in futures]
+    for job in jobs:
+        catalog.record(job[1], job[5])
+    return filenames
+
+
+def start_catalog_scan():
+    if not env_int("SQ_CATALOG_SCAN", 1):
+        return
+    catalog = get_catalog(folder_paths.get_output_directory())
+    threading.Thread(target=catalog.scan, name="sq-catalog-scan", daemon=True).start()
+
+
+def encode_frame(
+    pixels: np.ndarray,
+    save_path: str,
+    filename: str,
+    prompt,
+    extra_pnginfo,
+    metadata: MetadataOutput,
+    final: bool = False,
+    compress_level: int = 4,
+    compress_metadata: bool = False,
+):
+    """Write one frame and return the seconds it took.
+
+    Takes no locks, logs nothing and records no metrics, so it is safe to run
+    in a forked save worker. Callers record the timing."""
+    start = time.perf_counter()
+    try:
+        write_image(
+            Image.fromarray(pixels),
+            save_path,
+            filename,
+            prompt,
+            extra_pnginfo,
+            metadata,
+            final=final,
+            compress_level=compress_level,
+            compress_metadata=compress_metadata,
+        )
+    except BaseException:
+        # release the reserved name
+        os.remove(save_path)
+        raise
+    return time.perf_counter() - start
+
+
+def write_frame(*job, **options):
+    """encode_frame with its timing recorded, returns the filename"""
+    with timed("image_write"):
+        encode_frame(*job, **options)
+    return job[2]
+
+
+# chunks smaller than this are not worth the zlib overhead
+compressed_chunk_threshold = 1024
+
+
+def write_image(
+    img: Image.Image,
+    save_path: str,
+    filename: str,
+    prompt,
+    extra_pnginfo,
+    metadata: MetadataOutput,
+    final: bool = False,
+    compress_level: int = 4,
+    compress_metadata: bool = False,
+):
     civit_metadata = format_civit_metadata(metadata)
     metadata_str = json.dumps(metadata)
     prompt_str = json.dumps(prompt)
@@ -105,15 +304,22 @@ def save_image(
     if filename.endswith(".png"):
         mdata = None
         mdata = PngInfo()
-        mdata.add_text("parameters", civit_metadata)
-        mdata.add_text("metadata", metadata_str)
+
+        def add_text(key: str, value: str):
+            if compress_metadata and len(value) > compressed_chunk_threshold:
+                mdata.add_itxt(key, value, zip=True)
+            else:
+                mdata.add_text(key, value)
+
+        add_text("parameters", civit_metadata)
+        add_text("metadata", metadata_str)
         if not final:
             if not args.disable_metadata:
                 if prompt is not None:
-                    mdata.add_text("prompt", prompt_str)
+                    add_text("prompt", prompt_str)
                 if extra_pnginfo is not None:
                     for x in extra_pnginfo:
-                        mdata.add_text(x, json.dumps(extra_pnginfo[x]))
+                        add_text(x, json.dumps(extra_pnginfo[x]))
         img.save(
             save_path,
             pnginfo=mdata,
@@ -144,18 +350,50 @@ def save_image(
                     )
                     inital_exif -= 1
 
+        # pass exif to the encoder so the file is written once
         img.save(
             save_path,
             lossless=True,
+            exif=piexif.dump(exif),
         )
-        exif_bytes = piexif.dump(exif)
-        piexif.insert(exif_bytes, save_path)
-    return filename
+
+
+lora_mmap = bool(env_int("SQ_LORA_MMAP", 0))
+
+
+class MappedStateDict(dict):
+    """State dict whose tensors are memory mapped from a safetensors file"""
+
+
+lora_cache: LRUCache[tuple, dict] = LRUCache(
+    max_bytes=default_cache_budget("SQ_LORA_CACHE_MB", 0.05),
+    max_items=64,
+    # memory mapped tensors are backed by the page cache, count them as free
+    sizeof=lambda sd: 0 if isinstance(sd, MappedStateDict) else state_dict_size(sd),
+)
+metrics.register_cache("lora", lora_cache)
+
+
+@timed("lora_file_load")
+def load_lora_file(lora_path: str):
+    if lora_mmap and lora_path.lower().endswith(".safetensors"):
+        import safetensors
+
+        with safetensors.safe_open(lora_path, framework="pt", device="cpu") as f:
+            return MappedStateDict((k, f.get_tensor(k)) for k in f.keys())
+    return comfy.utils.load_torch_file(lora_path, safe_load=True)
+
+
+def get_lora(lora_name: str):
+    """LoRA state dict shared by the lora loaders, keyed on file identity"""
+    lora_path = folder_paths.get_full_path_or_raise("loras", lora_name)
+    return lora_cache.get_or_create(
+        file_identity(lora_path), lambda: load_lora_file(lora_path)
+    )
 
 
 def load_lora(model, clip, lora_name, model_strength, clip_strength):
-    lora_path = folder_paths.get_full_path("loras", lora_name)
-    lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
+    lora = get_lora(lora_name)
 
     model_lora, clip_lora = comfy.sd.load_lora_for_models(
         model, clip, lora, model_strength, clip_strength
@@ -163,6 +401,39 @@ def load_lora(model, clip, lora_name, model_strength, clip_strength):
     return model_lora, clip_lora
 
 
+@timed("lora_apply")
+def load_loras(model, clip, loras: typing.List[typing.Tuple[str, float, float]]):
+    """Apply several loras to one clone of the model and clip.
+
+    Equivalent to calling load_lora for each (name, model_strength,
+    clip_strength) in turn, without cloning the patchers and rebuilding the
+    key maps for every lora."""
+    if len(loras) == 0:
+        return model, clip
+    key_map = {}
+    if model is not None:
+        key_map = comfy.lora.model_lora_keys_unet(model.model, key_map)
+    if clip is not None:
+        key_map = comfy.lora.model_lora_keys_clip(clip.cond_stage_model, key_map)
+
+    model_lora = model.clone() if model is not None else None
+    clip_lora = clip.clone() if clip is not None else None
+    for lora_name, model_strength, clip_strength in loras:
+        lora = get_lora(lora_name)
+        if convert_lora is not None:
+            lora = convert_lora(lora)
+        loaded = comfy.lora.load_lora(lora, key_map)
+        k = set()
+        if model_lora is not None:
+            k.update(model_lora.add_patches(loaded, model_strength))
+        if clip_lora is not None:
+            k.update(clip_lora.add_patches(loaded, clip_strength))
+        for x in loaded:
+            if x not in k:
+                logging.warning("NOT LOADED {}".format(x))
+    return model_lora, clip_lora
+
+
 def format_civit_metadata(metadata: MetadataOutput):
     positive = ", ".join(metadata["positive"])
     for w in ["loli", "lolita", "underage", "child", "children"]:
@@ -0,0 +1,151 @@
+"""Content addressed storage for the ComfyUI prompt and workflow JSON.
+
+Instead of embedding the full prompt/workflow in every image, the writer can
+store each distinct blob once as `.sq_workflows/<ab>/<sha256>.json` in the
+output directory and embed only a `sq_workflow_refs` entry mapping each key
+(prompt, workflow, ...) to its digest. read_workflow() re-hydrates either
+form from an image file.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import typing
+
+import piexif
+
+from .extract import read_png_text, read_webp_exif
+from .metrics import metrics
+
+store_dirname = ".sq_workflows"
+refs_key = "sq_workflow_refs"
+# exif tags the writer stores prompt and extra_pnginfo entries in
+prompt_tag = 0x0110
+extra_pnginfo_tags = range(0x010F, 0x0100, -1)
+
+
+class WorkflowStore:
+    """Blobs are named by the sha256 of their content, so a written blob never
+    changes and concurrent writers of the same blob agree on its contents"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str):
+        return os.path.join(self.root, digest[:2], f"{digest}.json")
+
+    def put(self, data: str) -> str:
+        raw = data.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self.path(digest)
+        # checked on every put, the store may be pruned or moved while running
+        if os.path.exists(path):
+            metrics.inc("workflow_store.dedup")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(raw)
+            # readers never see a partially written blob
+            os.replace(tmp_path, path)
+            metrics.inc("workflow_store.write")
+            metrics.inc("workflow_store.bytes", len(raw))
+        return digest
+
+    def get(self, digest: str) -> typing.Optional[str]:
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            raise ValueError(f"invalid workflow digest: {digest}")
+        try:
+            with open(self.path(digest), "rb") as f:
+                return f.read().decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+    def put_workflow(self, prompt, extra_pnginfo) -> typing.Dict[str, str]:
+        """Store the prompt and each extra_pnginfo entry, return key -> digest"""
+        refs = {}
+        if prompt is not None:
+            refs["prompt"] = self.put(json.dumps(prompt))
+        for key, value in (extra_pnginfo or {}).items():
+            refs[key] = self.put(json.dumps(value))
+        return refs
+
+
+_stores: typing.Dict[str, WorkflowStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_workflow_store(output_dir: str):
+    root = os.path.join(os.path.abspath(output_dir), store_dirname)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = WorkflowStore(root)
+        return _stores[root]
+
+
+def find_workflow_store(path: str) -> typing.Optional[WorkflowStore]:
+    """Store in the nearest parent directory of an image that has one"""
+    directory = os.path.dirname(os.path.abspath(path))
+    while True:
+        if os.path.isdir(os.path.join(directory, store_dirname)):
+            return get_workflow_store(directory)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def read_workflow_chunks(path: str) -> typing.Dict[str, str]:
+    """Raw prompt/workflow entries (or the refs entry) embedded in an image"""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "rb") as f:
+        if ext == ".png":
+            text = read_png_text(f)
+            text.pop("parameters", None)
+            text.pop("metadata", None)
+            return text
+        if ext != ".webp":
+            raise ValueError(f"unsupported file type: {ext}")
+        exif = read_webp_exif(f)
+    if not exif:
+        return {}
+    chunks = {}
+    tags = piexif.load(exif)["0th"]
+    for tag in [prompt_tag, *extra_pnginfo_tags]:
+        value = tags.get(tag)
+        if value is None:
+            continue
+        value = value.decode("utf-8") if isinstance(value, bytes) else str(value)
+        key, sep, data = value.partition(":")
+        if sep:
+            chunks[key] = data
+    return chunks
+
+
+def read_workflow(
+    path: str, store: typing.Optional[WorkflowStore] = None
+) -> typing.Dict[str, typing.Any]:
+    """Prompt and workflow of an image, parsed, whether embedded or stored by
+    reference. Raises FileNotFoundError if a referenced blob is missing."""
+    chunks = read_workflow_chunks(path)
+    workflow = {}
+    refs_json = chunks.pop(refs_key, None)
+    if refs_json is not None:
+        store = store or find_workflow_store(path)
+        if store is None:
+            raise FileNotFoundError(f"no {store_dirname} store found for {path}")
+        for key, digest in json.loads(refs_json).items():
+            data = store.get(digest)
+            if data is None:
+                raise FileNotFoundError(f"workflow blob {digest} missing from store")
+            workflow[key] = json.loads(data)
+    for key, value in chunks.items():
+        if key in workflow:
+            continue
+        try:
+            workflow[key] = json.loads(value)
+        except ValueError:
+            # text chunks written by other tools
+            pass
+    return workflow
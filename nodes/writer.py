@@ -1,13 +1,14 @@
-from typing import Dict, Literal, Optional
+from typing import Dict, Literal, Optional, Tuple
 
 import torch
-from .utils import any_type, calculate_hash, save_image
+from .utils import any_type, calculate_hash, calculate_hashes, save_images
 from .types import MetadataOutput, GeneratorForward, LoraMetadata, PromptChain
-from .pure_utils import log
+from .pure_utils import log, timed
+from .save_queue import save_queue
 
 
 class SQImageWriter:
-    hash_cache: Dict[str, str] = {}
+    hash_cache: Dict[Tuple[str, int, int], str] = {}
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -62,6 +63,27 @@ class SQImageWriter:
                         "tooltip": "Pass in forwarded metadata from reader node. Seed, steps and cfg can be overriden by their respective inputs"
                     },
                 ),
+                "async_save": (
+                    ["false", "true"],
+                    {
+                        "default": "false",
+                        "tooltip": "Queue images to be written in the background and return immediately",
+                    },
+                ),
+                "compress_metadata": (
+                    ["false", "true"],
+                    {
+                        "default": "false",
+                        "tooltip": "Store large png metadata (workflow, prompt) as compressed iTXt chunks. Tools that only read tEXt chunks will not see them",
+                    },
+                ),
+                "store_workflow": (
+                    ["false", "true"],
+                    {
+                        "default": "false",
+                        "tooltip": "Write the ComfyUI prompt and workflow once to .sq_workflows in the output directory and embed only their hashes. ComfyUI cannot load the workflow by dropping such an image",
+                    },
+                ),
             },
             "hidden": {"prompt": "PROMPT", "extra_pnginfo": "EXTRA_PNGINFO"},
         }
@@ -73,6 +95,7 @@ class SQImageWriter:
     FUNCTION = "write"
     DESCRIPTION = "Save images with reusable generation metadata"
 
+    @timed("SQImageWriter.write")
     def write(
         self,
         image: torch.Tensor,
@@ -90,6 +113,9 @@ class SQImageWriter:
         negative: Optional[PromptChain] = None,
         generator_forward: Optional[GeneratorForward] = None,
         reader_forward: Optional[MetadataOutput] = None,
+        async_save: Literal["true", "false"] = "false",
+        compress_metadata: Literal["true", "false"] = "false",
+        store_workflow: Literal["true", "false"] = "false",
         prompt=None,
         extra_pnginfo=None,
     ):
@@ -118,6 +144,9 @@ class SQImageWriter:
                 raise ValueError(
                     "all inputs must be provided if reader forward is not provided"
                 )
+            lora_hashes = calculate_hashes(
+                self.hash_cache, [lora["name"] for lora in loras], "lora"
+            )
             metadata: MetadataOutput = {
                 "model": {
                     "name": generator_forward["model_name"],
@@ -140,11 +169,11 @@ class SQImageWriter:
                 "loras": [
                     {
                         "name": lora["name"],
-                        "sha": calculate_hash(self.hash_cache, lora["name"], "lora"),
+                        "sha": sha,
                         "clip_strength": lora["clip_strength"],
                         "model_strength": lora["model_strength"],
                     }
-                    for lora in loras
+                    for lora, sha in zip(loras, lora_hashes)
                 ],
                 "cfg": cfg,
                 "seed": seed,
@@ -156,16 +185,43 @@ class SQImageWriter:
                 "sampler": generator_forward["sampler"],
                 "scheduler": generator_forward["scheduler"],
             }  # type: ignore
-        filename = save_image(
-            image[0],
+        chain_variants = {}
+        if reader_forward is None:
+            # prompt chains expanded into a batch of variants
+            for key, chain in [("positive", positive), ("negative", negative)]:
+                variants = chain.get("variants")  # type: ignore
+                if not variants:
+                    continue
+                if len(variants) != image.shape[0]:
+                    raise ValueError(
+                        f"{key} prompt has {len(variants)} variants but the image "
+                        f"batch has {image.shape[0]} frames, so the metadata of "
+                        "each frame cannot be recorded"
+                    )
+                chain_variants[key] = variants
+        frame_metadata = []
+        for i in range(image.shape[0]):
+            m = metadata.copy()
+            m["seed"] = metadata["seed"] + i
+            for key, variants in chain_variants.items():
+                m[key] = variants[i]
+            frame_metadata.append(m)
+        filenames = save_images(
+            image,
             directory,
             filename,
             prompt,
             extra_pnginfo,
-            metadata,
+            frame_metadata,
             final=final == "true",
             timestamp_format=timestamp_format,
+            compress_metadata=compress_metadata == "true",
+            store_workflow=store_workflow == "true",
+            queue=save_queue if async_save == "true" else None,
         )
-        log(f"Saved image to {filename}")
+        if async_save == "true":
+            log("Queued images for saving to %s", ", ".join(filenames))
+        else:
+            log("Saved images to %s", ", ".join(filenames))
 
         return ()
@@ -1,6 +1,12 @@
+import asyncio
+import os
 import sys
+import folder_paths
 from server import PromptServer
 from aiohttp import web
+from ..nodes.catalog import get_catalog
+from ..nodes.metrics import metrics
+from ..nodes.workflow_store import get_workflow_store, read_workflow
 
 routes = PromptServer.instance.routes
 
@@ -8,3 +14,71 @@ routes = PromptServer.instance.routes
 @routes.get("/sq/restart")
 async def restart(request):
     sys.exit(69)
+
+
+@routes.get("/sq/catalog")
+async def catalog(request):
+    """Query the metadata catalog, e.g. /sq/catalog?lora=name&seed=123.
+    Pass refresh=1 to rescan the output directory first."""
+    query = request.rel_url.query
+    catalog = get_catalog(folder_paths.get_output_directory())
+    if query.get("refresh") == "1":
+        # a large output directory takes a while, keep the event loop free
+        await asyncio.get_running_loop().run_in_executor(None, catalog.scan)
+
+    def optional(key, cast=str):
+        return cast(query[key]) if key in query else None
+
+    try:
+        results = catalog.query(
+            model=optional("model"),
+            vae=optional("vae"),
+            lora=optional("lora"),
+            seed=optional("seed", int),
+            steps=optional("steps", int),
+            cfg=optional("cfg", float),
+            sampler=optional("sampler"),
+            scheduler=optional("scheduler"),
+            positive=optional("positive"),
+            negative=optional("negative"),
+            limit=optional("limit", int) or 100,
+        )
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    return web.json_response(results)
+
+
+@routes.get("/sq/stats")
+async def stats(request):
+    """Counters, timing histograms and cache hit rates. Pass
+    format=prometheus for the Prometheus text exposition format."""
+    if request.rel_url.query.get("format") == "prometheus":
+        return web.Response(
+            text=metrics.prometheus(), content_type="text/plain", charset="utf-8"
+        )
+    return web.json_response(metrics.snapshot())
+
+
+@routes.get("/sq/workflow")
+async def workflow(request):
+    """Resolve a stored workflow blob by digest (/sq/workflow?sha=...) or the
+    prompt and workflow of an output image (/sq/workflow?path=dir/image.png)"""
+    query = request.rel_url.query
+    output_dir = os.path.abspath(folder_paths.get_output_directory())
+    try:
+        if "sha" in query:
+            data = get_workflow_store(output_dir).get(query["sha"])
+            if data is None:
+                return web.json_response({"error": "not found"}, status=404)
+            return web.Response(text=data, content_type="application/json")
+        path = os.path.abspath(os.path.join(output_dir, query["path"]))
+        if os.path.commonpath([output_dir, path]) != output_dir:
+            return web.json_response({"error": "path outside output"}, status=400)
+        loop = asyncio.get_running_loop()
+        return web.json_response(await loop.run_in_executor(None, read_workflow, path))
+    except KeyError:
+        return web.json_response({"error": "pass sha or path"}, status=400)
+    except FileNotFoundError as e:
+        return web.json_response({"error": str(e)}, status=404)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)